@@ -0,0 +1,552 @@
+# benchmarks/bench_user_controller.py
+"""
+Benchmark de los endpoints de usuario contra un Mongo local o mongomock.
+
+    python -m benchmarks.bench_user_controller --users 5000 --apps-per-user 3 --out run.json
+    python -m benchmarks.bench_user_controller --mongo-uri mongodb://localhost:27017 --out run.json
+    python -m benchmarks.bench_user_controller --compare base.json run.json --threshold 0.15
+    python -m benchmarks.bench_user_controller --load http://localhost:8000 --server-pid 1234 --concurrency 1 10 100 500
+
+El envío de correos y el cifrado se reemplazan por stubs para medir solo el handler.
+"""
+import argparse
+import asyncio
+import hashlib
+import threading
+import inspect
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+from flask_restful import Api, Resource
+
+import controllers.user.user_controller as user_controller
+from utils.email_outbox import outbox
+from utils.password_hashing import password_hasher, bulk_password_hasher
+from utils import response_encoding
+from utils.server_response import ServerResponse, StatusCode
+from utils.name_resolver import app_names, role_names
+from utils import rate_limiter
+
+PASSWORD = "Bench#Passw0rd"
+
+
+def _fake_encrypt(value):
+    return "bench$" + hashlib.sha256(value.encode()).hexdigest()
+
+
+def _fake_verify(plain, hashed):
+    return _fake_encrypt(plain) == hashed
+
+
+def _slow_encrypt(value):
+    # costo de CPU comparable a un hash de contraseña real
+    hashlib.pbkdf2_hmac("sha256", value.encode(), b"bench", 200_000)
+    return _fake_encrypt(value)
+
+
+def _slow_verify(plain, hashed):
+    return _slow_encrypt(plain) == hashed
+
+
+class _NullSender:
+    def send_codes(self, recipient, codes):
+        pass
+
+    def send_new_password(self, recipient, password):
+        pass
+
+
+class _BenchDBManager:
+    # stand-in de __dbmanager__ sobre una colección pymongo/mongomock
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def get_by_query(self, query):
+        return list(self.collection.find(query))
+
+    def get_by_id(self, id):
+        return self.collection.find_one({"_id": ObjectId(id)})
+
+    def update_by_condition(self, condition, data):
+        return self.collection.update_one(condition, {"$set": data})
+
+
+class _BenchUserModel:
+    collection = None
+
+    @classmethod
+    def find_by_email(cls, email):
+        return cls.collection.find_one({"email": email})
+
+    @classmethod
+    def create_user(cls, data):
+        return cls.collection.insert_one(dict(data, password=_fake_encrypt(data["password"])))
+
+    @classmethod
+    def update_user(cls, email, data):
+        return cls.collection.update_one({"email": email}, {"$set": data})
+
+    @staticmethod
+    def verify_password(plain, hashed):
+        return _fake_encrypt(plain) == hashed
+
+    @classmethod
+    def update_password(cls, email, password):
+        return cls.collection.update_one({"email": email}, {"$set": {"password": password}})
+
+    @classmethod
+    def update_reset_password_info(cls, email, code, expiration, password):
+        result = cls.collection.update_one(
+            {"email": email},
+            {"$set": {"verification_code": code, "code_expliration": expiration, "password": password}}
+        )
+        return result.matched_count > 0
+
+
+def _database(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        db = MongoClient(mongo_uri).get_database("user_controller_bench")
+        for name in ("users", "apps", "roles"):
+            db.drop_collection(name)
+        return db
+    import mongomock
+    return mongomock.MongoClient().db
+
+
+def seed(db, users, apps_per_user, apps, roles):
+    app_ids = [ObjectId() for _ in range(apps)]
+    role_ids = [ObjectId() for _ in range(roles)]
+    db.apps.insert_many([{"_id": oid, "name": f"app{i}"} for i, oid in enumerate(app_ids)])
+    db.roles.insert_many([{"_id": oid, "name": f"role{i}"} for i, oid in enumerate(role_ids)])
+
+    expiry = datetime.utcnow() + timedelta(days=1)
+    docs = []
+    for i in range(users):
+        user_apps = []
+        for j, app_oid in enumerate(random.sample(app_ids, min(apps_per_user, apps))):
+            user_apps.append({
+                "role": random.choice(role_ids),
+                "app": app_oid,
+                # el primer elemento queda Pending con un código conocido para /user/verification
+                "code": f"{i:06d}"[-6:] if j == 0 else "",
+                "token": "",
+                "status": "Pending" if j == 0 else "Active",
+                "code_expliration": expiry if j == 0 else None,
+                "is_session_active": False,
+            })
+        docs.append({
+            "name": f"User {i}",
+            "email": f"user{i}@bench.local",
+            "password": _fake_encrypt(PASSWORD),
+            "apps": user_apps,
+        })
+    ids = db.users.insert_many(docs).inserted_ids
+    first_apps = [d["apps"][0]["app"] if d["apps"] else None for d in docs]
+    return {"app_ids": app_ids, "role_ids": role_ids, "user_ids": ids, "first_apps": first_apps}
+
+
+def build_app(db):
+    user_controller.__dbmanager__ = _BenchDBManager(db.users)
+    _BenchUserModel.collection = db.users
+    user_controller.UserModel = _BenchUserModel
+    password_hasher.configure(encrypt_fn=_fake_encrypt, verify_fn=_fake_verify)
+    bulk_password_hasher.configure(encrypt_fn=_fake_encrypt, verify_fn=_fake_verify)
+    app_names._collection_getter = lambda: db.apps
+    role_names._collection_getter = lambda: db.roles
+    outbox.sender = _NullSender()
+    # sin reglas: el cliente de pruebas tiene siempre la misma IP y mediría solo el 429
+    rate_limiter.limiter = rate_limiter.RateLimiter(rate_limiter.InMemoryBackend(), rules={})
+
+    app = Flask(__name__)
+    api = Api(app)
+    for _, cls in inspect.getmembers(user_controller, inspect.isclass):
+        if issubclass(cls, Resource) and cls is not Resource and getattr(cls, "route", None):
+            api.add_resource(cls, cls.route)
+    return app
+
+
+# cada endpoint corre en su propio proceso (datos recién sembrados y RSS propio)
+SCENARIOS = ("enrollment", "list", "item_get", "item_patch", "password_put",
+             "password_post", "verification", "item_delete")
+
+
+def _scenarios(seeded, users):
+    app_ids, role_ids, user_ids = seeded["app_ids"], seeded["role_ids"], seeded["user_ids"]
+    counter = {"enroll": 0}
+
+    # cada escenario prepara lo que necesite y devuelve la petición a medir (sin argumentos)
+    def enrollment(client, i):
+        counter["enroll"] += 1
+        return lambda: client.post("/user/enrollment", json={
+            "name": "New User", "email": f"new{counter['enroll']}@bench.local", "password": PASSWORD,
+            "apps": [{"app": str(random.choice(app_ids)), "role": str(random.choice(role_ids))}],
+        })
+
+    def list_by_app(client, i):
+        return lambda: client.get(f"/user?app_id={random.choice(app_ids)}&limit=100")
+
+    def item_get(client, i):
+        return lambda: client.get(f"/user/{random.choice(user_ids)}")
+
+    def item_patch(client, i):
+        n = i % users
+        return lambda: client.patch(f"/user/{user_ids[n]}", json={"app_id": str(seeded["first_apps"][n]), "is_session_active": True})
+
+    def item_delete(client, i):
+        return lambda: client.delete(f"/user/{user_ids[i % users]}")
+
+    def password_put(client, i):
+        email = f"user{i % users}@bench.local"
+        user_controller.UserModel.collection.update_one(
+            {"email": email, "apps.0": {"$exists": True}}, {"$set": {"apps.0.status": "Active", "password": _fake_encrypt(PASSWORD)}}
+        )
+        return lambda: client.put("/user/password", json={
+            "user_email": email, "old_password": PASSWORD,
+            "new_password": PASSWORD, "confirm_password": PASSWORD,
+        })
+
+    def password_post(client, i):
+        return lambda: client.post("/user/password", json={"email": f"user{i % users}@bench.local"})
+
+    def verification(client, i):
+        n = i % users
+        return lambda: client.put("/user/verification", json={"user_email": f"user{n}@bench.local", "verification_code": f"{n:06d}"[-6:]})
+
+    scenarios = {
+        "enrollment": enrollment, "list": list_by_app, "item_get": item_get,
+        "item_patch": item_patch, "password_put": password_put, "password_post": password_post,
+        "verification": verification, "item_delete": item_delete,
+    }
+    return [(name, scenarios[name]) for name in SCENARIOS]
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct * (len(sorted_values) - 1))))]
+
+
+def run(args):
+    """
+    Lanza un subproceso por endpoint: ru_maxrss es el máximo de toda la vida del proceso,
+    así que en un solo proceso cada endpoint heredaría el pico del anterior.
+    """
+    results = {}
+    for name in SCENARIOS:
+        if args.only and name not in args.only:
+            continue
+        argv = [sys.executable, "-m", "benchmarks.bench_user_controller", "--in-process", "--only", name,
+                "--users", str(args.users), "--apps-per-user", str(args.apps_per_user), "--apps", str(args.apps),
+                "--roles", str(args.roles), "--requests", str(args.requests), "--warmup", str(args.warmup),
+                "--seed", str(args.seed)]
+        if args.mongo_uri:
+            argv += ["--mongo-uri", args.mongo_uri]
+        output = subprocess.run(argv, check=True, capture_output=True, text=True).stdout
+        results.update(json.loads(output)["results"])
+
+    return {
+        "params": {"users": args.users, "apps_per_user": args.apps_per_user, "apps": args.apps,
+                   "roles": args.roles, "requests": args.requests, "backend": "mongod" if args.mongo_uri else "mongomock"},
+        "results": results,
+    }
+
+
+def run_in_process(args):
+    random.seed(args.seed)
+    db = _database(args.mongo_uri)
+    seeded = seed(db, args.users, args.apps_per_user, args.apps, args.roles)
+    client = build_app(db).test_client()
+
+    results = {}
+    for name, scenario in _scenarios(seeded, args.users):
+        if args.only and name not in args.only:
+            continue
+        for i in range(args.warmup):
+            scenario(client, i)()
+        latencies, errors = [], 0
+        for i in range(args.requests):
+            # la preparación del escenario (p. ej. el update_one de password_put) queda fuera de t0
+            send = scenario(client, args.warmup + i)
+            t0 = time.perf_counter()
+            response = send()
+            response.get_data()
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+        elapsed = sum(latencies) / 1000
+        latencies.sort()
+        results[name] = {
+            "requests": args.requests,
+            "errors": errors,
+            "p50_ms": round(_percentile(latencies, 0.50), 3),
+            "p99_ms": round(_percentile(latencies, 0.99), 3),
+            "throughput_rps": round(args.requests / elapsed, 1) if elapsed else 0.0,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    return {
+        "params": {"users": args.users, "apps_per_user": args.apps_per_user, "apps": args.apps,
+                   "roles": args.roles, "requests": args.requests, "backend": "mongod" if args.mongo_uri else "mongomock"},
+        "results": results,
+    }
+
+
+def run_hash_saturation(args):
+    """
+    Latencia de GET /user/<id> mientras N clientes saturan PUT /user/password
+    con un hash costoso en el pool de procesos.
+    """
+    random.seed(args.seed)
+    db = _database(args.mongo_uri)
+    seeded = seed(db, args.users, args.apps_per_user, args.apps, args.roles)
+    app = build_app(db)
+    password_hasher.configure(encrypt_fn=_slow_encrypt, verify_fn=_slow_verify)
+    db.users.update_many({}, {"$set": {"apps.0.status": "Active", "password": _slow_encrypt(PASSWORD)}})
+
+    stop = threading.Event()
+    statuses = {}
+    lock = threading.Lock()
+
+    def hammer(n):
+        client = app.test_client()
+        i = n
+        while not stop.is_set():
+            response = client.put("/user/password", json={
+                "user_email": f"user{i % args.users}@bench.local", "old_password": PASSWORD,
+                "new_password": PASSWORD, "confirm_password": PASSWORD,
+            })
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            i += args.hash_clients
+
+    def measure():
+        client = app.test_client()
+        latencies = []
+        for _ in range(args.requests):
+            t0 = time.perf_counter()
+            client.get(f"/user/{random.choice(seeded['user_ids'])}").get_data()
+            latencies.append((time.perf_counter() - t0) * 1000)
+        latencies.sort()
+        return {"p50_ms": round(_percentile(latencies, 0.50), 3), "p99_ms": round(_percentile(latencies, 0.99), 3)}
+
+    idle = measure()
+    threads = [threading.Thread(target=hammer, args=(n,), daemon=True) for n in range(args.hash_clients)]
+    for t in threads:
+        t.start()
+    time.sleep(1.0)
+    saturated = measure()
+    stop.set()
+    for t in threads:
+        t.join()
+    password_hasher.shutdown()
+
+    return {
+        "params": {"hash_clients": args.hash_clients, "hash_workers": password_hasher.workers,
+                   "max_pending": password_hasher.max_pending, "requests": args.requests},
+        "item_get_idle": idle,
+        "item_get_while_hashing": saturated,
+        "password_put_statuses": {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+
+def run_encoding(args):
+    """
+    Micro-benchmark de serialización de un listado de args.users usuarios:
+    camino anterior (dict() + ServerResponse.to_response) contra response_encoding.
+    """
+    random.seed(args.seed)
+    app_ids = [ObjectId() for _ in range(args.apps)]
+    role_ids = [ObjectId() for _ in range(args.roles)]
+    expiry = datetime.utcnow() + timedelta(minutes=5)
+
+    def make_docs():
+        return [{
+            "_id": ObjectId(), "name": f"User {i}", "email": f"user{i}@bench.local",
+            "apps": [{"app": random.choice(app_ids), "role": random.choice(role_ids), "status": "Active",
+                      "code": "", "token": "", "code_expliration": expiry, "is_session_active": False}
+                     for _ in range(args.apps_per_user)],
+        } for i in range(args.users)]
+
+    app = Flask(__name__)
+
+    def legacy(docs):
+        data = []
+        for d in docs:
+            d = dict(d)
+            d["id"] = str(d.pop("_id"))
+            data.append(d)
+        with app.test_request_context():
+            response = ServerResponse(data=data, status=StatusCode.OK).to_response()
+            return response[0] if isinstance(response, tuple) else response
+
+    def fast(docs):
+        return response_encoding.json_response(data=[response_encoding.public_document(d) for d in docs])
+
+    results = {}
+    candidates = [("legacy", legacy, None)] + [(f"fast_{name}", fast, name) for name in response_encoding._backends]
+    for name, fn, backend in candidates:
+        if backend:
+            response_encoding.set_backend(backend)
+        timings = []
+        for _ in range(args.repeat):
+            docs = make_docs()
+            t0 = time.perf_counter()
+            fn(docs)
+            timings.append((time.perf_counter() - t0) * 1000)
+        timings.sort()
+        results[name] = {"p50_ms": round(_percentile(timings, 0.50), 3), "min_ms": round(timings[0], 3)}
+
+    return {"params": {"users": args.users, "apps_per_user": args.apps_per_user, "repeat": args.repeat}, "results": results}
+
+
+def _process_rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+async def _load_level(base_url, concurrency, duration, user_ids, app_ids):
+    import httpx
+
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(client):
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            if random.random() < 0.5:
+                path = f"/user/{random.choice(user_ids)}"
+            else:
+                path = f"/user?app_id={random.choice(app_ids)}&limit=50"
+            t0 = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(_percentile(latencies, 0.50), 3),
+        "p99_ms": round(_percentile(latencies, 0.99), 3),
+    }
+
+
+def run_load(args):
+    """
+    Carga HTTP contra un servidor ya levantado (WSGI o ASGI) con niveles crecientes de
+    concurrencia; con --server-pid registra el RSS del servidor en cada nivel.
+    Los ids se toman del seed de --mongo-uri, que debe apuntar a la misma base del servidor.
+    """
+    random.seed(args.seed)
+    db = _database(args.mongo_uri)
+    seeded = seed(db, args.users, args.apps_per_user, args.apps, args.roles)
+    user_ids = [str(i) for i in seeded["user_ids"]]
+    app_ids = [str(i) for i in seeded["app_ids"]]
+
+    levels = []
+    for concurrency in args.concurrency:
+        level = asyncio.run(_load_level(args.load, concurrency, args.duration, user_ids, app_ids))
+        if args.server_pid:
+            level["server_rss_kb"] = _process_rss_kb(args.server_pid)
+        levels.append(level)
+    return {"params": {"url": args.load, "duration_s": args.duration}, "levels": levels}
+
+
+def compare(base, current, threshold):
+    """
+    Compara dos corridas; regresión = p50/p99 o RSS peor que threshold, o throughput menor.
+    """
+    regressions, rows = [], []
+    for name, cur in current["results"].items():
+        old = base["results"].get(name)
+        if not old:
+            continue
+        for metric, higher_is_worse in (("p50_ms", True), ("p99_ms", True), ("throughput_rps", False), ("peak_rss_kb", True)):
+            before, after = old[metric], cur[metric]
+            change = ((after - before) / before) if before else 0.0
+            worse = change > threshold if higher_is_worse else change < -threshold
+            rows.append({"endpoint": name, "metric": metric, "base": before, "current": after,
+                         "change_pct": round(change * 100, 1), "regression": worse})
+            if worse:
+                regressions.append(f"{name}.{metric}")
+    return {"regressions": regressions, "rows": rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="User controller endpoint benchmark")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--apps-per-user", type=int, default=3)
+    parser.add_argument("--apps", type=int, default=20)
+    parser.add_argument("--roles", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="run only these endpoints")
+    parser.add_argument("--mongo-uri", help="use a local mongod instead of mongomock")
+    parser.add_argument("--out", help="write the JSON report to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "CURRENT"), help="compare two JSON reports")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    parser.add_argument("--hash-saturation", action="store_true",
+                        help="measure GET /user/<id> latency while password hashing is saturated")
+    parser.add_argument("--hash-clients", type=int, default=32)
+    parser.add_argument("--encoding", action="store_true",
+                        help="serialization micro-benchmark (use --users 10000)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--load", metavar="URL", help="HTTP load test against a running server")
+    parser.add_argument("--server-pid", type=int, help="server process to sample RSS from")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--in-process", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as fb, open(args.compare[1]) as fc:
+            report = compare(json.load(fb), json.load(fc), args.threshold)
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 1 if report["regressions"] else 0
+
+    if args.load:
+        report = run_load(args)
+    elif args.encoding:
+        report = run_encoding(args)
+    elif args.hash_saturation:
+        report = run_hash_saturation(args)
+    elif args.in_process:
+        report = run_in_process(args)
+    else:
+        report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
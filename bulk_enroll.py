@@ -0,0 +1,40 @@
+# scripts/bulk_enroll.py
+"""
+Enrollment masivo desde la línea de comandos:
+
+    python -m scripts.bulk_enroll students.jsonl
+    python -m scripts.bulk_enroll students.csv --format csv --chunk-size 2000
+"""
+import argparse
+import json
+import sys
+from collections import Counter
+
+from controllers.user.user_controller import bulk_enroll_records, iter_enrollment_records
+from utils.email_outbox import outbox
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk user enrollment from JSONL or CSV")
+    parser.add_argument("path", help="input file ('-' for stdin)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "jsonl")
+    fh = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+    try:
+        results = bulk_enroll_records(iter_enrollment_records(fh, fmt), chunk_size=args.chunk_size)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+    outbox.flush()
+    summary = Counter(r["status"] for r in results)
+    json.dump({"summary": dict(summary, total=len(results)), "results": results}, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    return 1 if summary.get("error") or summary.get("conflict") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
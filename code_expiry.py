@@ -0,0 +1,149 @@
+# utils/code_expiry.py
+"""
+Expiración de códigos de verificación en apps[].code_expliration como fecha BSON.
+
+    python -m utils.code_expiry migrate [--batch-size 500]   # texto "%Y/%m/%d %H:%M:%S" -> fecha
+    python -m utils.code_expiry sweep [--grace-hours 24]     # limpia los códigos Pending vencidos
+    python -m utils.code_expiry sweep --remove-assignments   # quita además la asignación (role, app)
+
+El barrido en segundo plano solo limpia códigos; CODE_SWEEPER_REMOVE=1 lo hace quitar las
+asignaciones Pending vencidas.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from models.user import memberships
+
+LEGACY_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+def _parse_legacy(value):
+    try:
+        return datetime.strptime(value, LEGACY_FORMAT) if value else None
+    except ValueError:
+        return None
+
+
+def migrate_string_expirations(collection, batch_size=500):
+    """
+    Convierte las expiraciones guardadas como texto a fecha, en lotes de bulk_write.
+    El filtro incluye el valor anterior para no pisar cambios concurrentes.
+    Solo cambia code_expliration, que no se replica en user_app_memberships.
+    """
+    cursor = collection.find(
+        {"apps": {"$elemMatch": {"code_expliration": {"$type": "string"}}}},
+        {"apps.code_expliration": 1}
+    ).batch_size(batch_size)
+
+    ops, converted = [], 0
+    for doc in cursor:
+        for i, app in enumerate(doc.get("apps") or []):
+            old = app.get("code_expliration")
+            if not isinstance(old, str):
+                continue
+            ops.append(UpdateOne(
+                {"_id": doc["_id"], f"apps.{i}.code_expliration": old},
+                {"$set": {f"apps.{i}.code_expliration": _parse_legacy(old)}}
+            ))
+        if len(ops) >= batch_size:
+            converted += collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        converted += collection.bulk_write(ops, ordered=False).modified_count
+    return converted
+
+
+def sweep_expired_codes(collection, grace=timedelta(hours=24), batch_size=1000, remove_assignments=False):
+    """
+    Limpia code / code_expliration de las asignaciones Pending cuyo código venció hace más de
+    `grace`; la asignación (role, app) se conserva. Con remove_assignments=True se quitan
+    de apps[] (el usuario desaparece de GET /user?app_id= y puede volver a enrolarse).
+    """
+    cutoff = datetime.utcnow() - grace
+    expired = {"status": "Pending", "code_expliration": {"$lt": cutoff}}
+    query = {"apps": {"$elemMatch": expired}}
+    if not remove_assignments:
+        # no cambia role/status/is_session_active: las membresías no se tocan
+        return collection.update_many(
+            query,
+            {"$set": {"apps.$[elem].code": "", "apps.$[elem].code_expliration": None}},
+            array_filters=[{f"elem.{k}": v for k, v in expired.items()}]
+        ).modified_count
+
+    pull = {"$pull": {"apps": expired}}
+    if not memberships.enabled():
+        return collection.update_many(query, pull).modified_count
+
+    # modo memberships: por lotes de ids, para resincronizar exactamente los usuarios tocados
+    removed = 0
+    while True:
+        ids = [d["_id"] for d in collection.find(query, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return removed
+        removed += collection.update_many({"_id": {"$in": ids}, **query}, pull).modified_count
+        memberships.sync_users(collection, {"_id": {"$in": ids}})
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def start_sweeper_once(collection, interval=None, grace=timedelta(hours=24), remove_assignments=None):
+    # un hilo por proceso; CODE_SWEEPER_INTERVAL=0 lo desactiva
+    global _sweeper
+    interval = int(os.getenv("CODE_SWEEPER_INTERVAL", "300")) if interval is None else interval
+    if remove_assignments is None:
+        remove_assignments = os.getenv("CODE_SWEEPER_REMOVE") == "1"
+    if _sweeper is not None or interval <= 0:
+        return _sweeper
+    with _sweeper_lock:
+        if _sweeper is not None:
+            return _sweeper
+        stop = threading.Event()
+
+        def _run():
+            while not stop.wait(interval):
+                try:
+                    swept = sweep_expired_codes(collection, grace, remove_assignments=remove_assignments)
+                    if swept:
+                        logging.info(f"Expired verification codes swept from {swept} user(s)")
+                except Exception as e:
+                    logging.warning(f"Expired code sweep failed: {e}")
+
+        _sweeper = threading.Thread(target=_run, name="code-expiry-sweeper", daemon=True)
+        _sweeper.stop = stop
+        _sweeper.start()
+    return _sweeper
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verification code expiry maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="convert string expirations to BSON dates")
+    migrate.add_argument("--batch-size", type=int, default=500)
+    sweep = sub.add_parser("sweep", help="clear expired Pending verification codes")
+    sweep.add_argument("--grace-hours", type=float, default=24)
+    sweep.add_argument("--remove-assignments", action="store_true",
+                       help="also remove the expired Pending (role, app) assignments")
+    args = parser.parse_args(argv)
+
+    from models.user.db_queries import __dbmanager__
+    collection = __dbmanager__.collection
+
+    if args.command == "migrate":
+        print(f"Converted {migrate_string_expirations(collection, args.batch_size)} expiration(s)")
+    else:
+        swept = sweep_expired_codes(collection, timedelta(hours=args.grace_hours),
+                                    remove_assignments=args.remove_assignments)
+        print(f"Swept {swept} user(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# utils/email_outbox.py
+import atexit
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+from utils import email_manager
+from utils.email_manager import send_email, send_email_new_password
+
+
+class EmailManagerSender:
+    # envío por utils.email_manager (configuración SMTP del servicio)
+
+    def send_codes(self, recipient, codes):
+        # la plantilla de send_email es de un solo código: varios códigos van por
+        # email_manager.send_email_codes o, si no existe, en un correo por código
+        if len(codes) == 1:
+            send_email(recipient, codes[0])
+            return
+        send_many = getattr(email_manager, "send_email_codes", None)
+        if send_many is not None:
+            send_many(recipient, codes)
+            return
+        for code in codes:
+            send_email(recipient, code)
+
+    def send_new_password(self, recipient, password):
+        send_email_new_password(recipient, password)
+
+
+class SmtpSender:
+    # envío directo por smtplib; útil contra un servidor SMTP falso local en pruebas
+
+    def __init__(self, host="localhost", port=1025, sender="no-reply@localhost", username=None, password=None,
+                 timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sender = sender
+        self.username = username
+        self.password = password
+
+    def _send(self, recipient, subject, body):
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = recipient
+        msg["Subject"] = subject
+        msg.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.username:
+                smtp.starttls()
+                smtp.login(self.username, self.password)
+            smtp.send_message(msg)
+
+    def send_codes(self, recipient, codes):
+        lines = "\n".join(f"- {c}" for c in codes)
+        self._send(recipient, "Verification code", f"Your verification code(s):\n{lines}\n")
+
+    def send_new_password(self, recipient, password):
+        self._send(recipient, "Temporary password", f"Your temporary password is: {password}\n")
+
+
+class EmailOutbox:
+    """
+    Cola de correos con pool de workers acotado, reintentos con backoff exponencial
+    y agrupación de códigos de verificación por destinatario.
+    Con la cola llena el correo se intenta una sola vez en el thread del request, sin
+    reintentos ni backoff; si falla se registra y se descarta.
+    """
+
+    def __init__(self, sender=None, workers=4, max_queue=1000, max_retries=3, backoff=1.0):
+        self.sender = sender or EmailManagerSender()
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending_codes = {}   # recipient -> [codes] aún no tomados por un worker
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"email-outbox-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def enqueue_codes(self, recipient, codes):
+        codes = [str(c) for c in codes if c]
+        if not codes:
+            return
+        self._ensure_started()
+        with self._lock:
+            pending = self._pending_codes.get(recipient)
+            if pending is not None:
+                # ya hay un mensaje en cola para este destinatario: se agrega al mismo
+                pending.extend(codes)
+                return
+            self._pending_codes[recipient] = list(codes)
+        if not self._put(("codes", recipient, None)):
+            with self._lock:
+                codes = self._pending_codes.pop(recipient, codes)
+            self._deliver("codes", recipient, codes, retries=0)
+
+    def enqueue_new_password(self, recipient, password):
+        self._ensure_started()
+        if not self._put(("new_password", recipient, password)):
+            self._deliver("new_password", recipient, password, retries=0)
+
+    def _put(self, job):
+        try:
+            self._queue.put_nowait(job)
+            return True
+        except queue.Full:
+            logging.warning(f"Email outbox full, sending to {job[1]} synchronously (single attempt)")
+            return False
+
+    def _worker(self):
+        while True:
+            kind, recipient, payload = self._queue.get()
+            try:
+                if kind == "codes":
+                    with self._lock:
+                        payload = self._pending_codes.pop(recipient, [])
+                self._deliver(kind, recipient, payload)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, kind, recipient, payload, retries=None):
+        if not payload:
+            return
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                if kind == "codes":
+                    self.sender.send_codes(recipient, payload)
+                else:
+                    self.sender.send_new_password(recipient, payload)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    logging.error(f"Email send failed to {recipient} after {attempt + 1} attempts: {e}")
+                    return
+                logging.warning(f"Email send failed to {recipient} (attempt {attempt + 1}): {e}")
+                time.sleep(self.backoff * (2 ** attempt))
+
+    def flush(self, timeout=None):
+        # espera a que se vacíe la cola (pruebas / apagado)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+outbox = EmailOutbox(
+    workers=int(os.getenv("EMAIL_OUTBOX_WORKERS", "4")),
+    max_queue=int(os.getenv("EMAIL_OUTBOX_MAX_QUEUE", "1000")),
+    max_retries=int(os.getenv("EMAIL_OUTBOX_MAX_RETRIES", "3")),
+)
+atexit.register(outbox.flush, 10)
@@ -0,0 +1,251 @@
+# utils/idempotency.py
+"""
+Soporte de Idempotency-Key: la primera petición con una clave ejecuta el handler y guarda
+su respuesta; los reintentos la reciben tal cual (Idempotent-Replayed: true) con una sola
+búsqueda de la clave. Las peticiones concurrentes con la misma clave esperan a la primera.
+
+Backend en memoria por defecto; IDEMPOTENCY_BACKEND=mongo lo comparte entre workers.
+
+Va por fuera de @rate_limited: un replay cuesta solo la búsqueda de la clave y no consume
+el límite. Los 429 y 5xx no se guardan (liberan la clave).
+"""
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from flask import request, make_response, Response
+from pymongo.errors import DuplicateKeyError
+
+from utils.server_response import ServerResponse, StatusCode
+
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+# cuánto espera una petición concurrente a que termine la que tiene la clave
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "15"))
+
+# vida de la marca "en curso"; se extiende a IDEMPOTENCY_TTL al guardar la respuesta
+PENDING_LEASE = float(os.getenv("IDEMPOTENCY_PENDING_LEASE", str(IDEMPOTENCY_WAIT * 2)))
+
+PENDING = "pending"
+DONE = "done"
+CONFLICT = "conflict"
+
+
+class InMemoryStore:
+
+    def __init__(self, maxsize=10000):
+        self._entries = OrderedDict()   # key -> (record, expires_at)
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[0]
+
+    def put_if_absent(self, key, record, ttl):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                return False
+            self._set(key, record, ttl)
+            return True
+
+    def set(self, key, record, ttl):
+        with self._lock:
+            self._set(key, record, ttl)
+
+    def _set(self, key, record, ttl):
+        self._entries[key] = (record, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class MongoStore:
+    # colección con índice TTL sobre expires_at; _id = clave
+
+    def __init__(self, collection_getter):
+        self._collection_getter = collection_getter
+        self._indexed = False
+
+    def _collection(self):
+        collection = self._collection_getter()
+        if not self._indexed:
+            collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexed = True
+        return collection
+
+    def get(self, key):
+        doc = self._collection().find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return doc.get("record") if doc else None
+
+    def put_if_absent(self, key, record, ttl):
+        collection = self._collection()
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+        try:
+            collection.insert_one({"_id": key, "record": record, "expires_at": expires_at})
+            return True
+        except DuplicateKeyError:
+            # una clave vencida que el TTL monitor aún no borró se puede reutilizar
+            result = collection.update_one(
+                {"_id": key, "expires_at": {"$lte": datetime.utcnow()}},
+                {"$set": {"record": record, "expires_at": expires_at}}
+            )
+            return result.modified_count == 1
+
+    def set(self, key, record, ttl):
+        self._collection().update_one(
+            {"_id": key},
+            {"$set": {"record": record, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True
+        )
+
+    def delete(self, key):
+        self._collection().delete_one({"_id": key})
+
+
+def _mongo_collection():
+    from models.user.db_queries import __dbmanager__
+    return __dbmanager__.collection.database["idempotency_keys"]
+
+
+store = MongoStore(_mongo_collection) if os.getenv("IDEMPOTENCY_BACKEND") == "mongo" else InMemoryStore()
+
+_inflight = {}   # key -> threading.Event (coalescing dentro del proceso)
+_inflight_lock = threading.Lock()
+
+REUSED_KEY = "Idempotency-Key was already used with a different request"
+IN_PROGRESS = "A request with this Idempotency-Key is still in progress"
+
+
+def request_key(scope, header, body):
+    # (clave en el store, huella del body)
+    return f"{scope}:{header}", hashlib.sha256(body or b"").hexdigest()
+
+
+def check(key, fingerprint):
+    """
+    Estado de una clave: (DONE, record) para replay, (CONFLICT, mensaje),
+    (PENDING, None) si otra petición la tiene, o (None, None) si está libre.
+    """
+    record = store.get(key)
+    if record is None:
+        return None, None
+    if record["fingerprint"] != fingerprint:
+        return CONFLICT, REUSED_KEY
+    return record["state"], record if record["state"] == DONE else None
+
+
+def claim(key, fingerprint):
+    # lease corto: si el worker muere a mitad del request la clave se libera sola
+    return store.put_if_absent(key, {"state": PENDING, "fingerprint": fingerprint}, PENDING_LEASE)
+
+
+def complete(key, fingerprint, status, body, content_type):
+    # solo las respuestas terminadas se guardan por IDEMPOTENCY_TTL; 429 y 5xx liberan la clave
+    if status >= 500 or status == 429:
+        store.delete(key)
+        return
+    store.set(key, {
+        "state": DONE,
+        "fingerprint": fingerprint,
+        "status": status,
+        "body": body,
+        "content_type": content_type,
+    }, IDEMPOTENCY_TTL)
+
+
+def release(key):
+    store.delete(key)
+
+
+def _replay(record):
+    response = Response(record["body"], status=record["status"], content_type=record["content_type"])
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _conflict(message):
+    return ServerResponse(message=message, status=StatusCode.CONFLICT).to_response()
+
+
+def _wait_for(key, fingerprint):
+    # espera a la petición que tiene la clave (evento local o, entre workers, sondeo del store)
+    with _inflight_lock:
+        event = _inflight.get(key)
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT
+    while time.monotonic() < deadline:
+        if event is not None:
+            event.wait(max(0.0, deadline - time.monotonic()))
+        state, value = check(key, fingerprint)
+        if state is None:
+            return None
+        if state == CONFLICT:
+            return _conflict(value)
+        if state == DONE:
+            return _replay(value)
+        if event is None:
+            time.sleep(0.05)
+    return _conflict(IN_PROGRESS)
+
+
+def idempotent(scope):
+    """
+    Decorador para métodos de Resource. Sin header Idempotency-Key no hace nada.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get("Idempotency-Key")
+            if not header:
+                return fn(*args, **kwargs)
+
+            key, fingerprint = request_key(scope, header, request.get_data())
+
+            # replay: una sola búsqueda
+            state, value = check(key, fingerprint)
+            if state == CONFLICT:
+                return _conflict(value)
+            if state == DONE:
+                return _replay(value)
+
+            if not claim(key, fingerprint):
+                waited = _wait_for(key, fingerprint)
+                if waited is not None:
+                    return waited
+                # la petición original falló y liberó la clave: se ejecuta esta
+                if not claim(key, fingerprint):
+                    return _conflict(IN_PROGRESS)
+
+            event = threading.Event()
+            with _inflight_lock:
+                _inflight[key] = event
+            try:
+                response = make_response(fn(*args, **kwargs))
+                if response.is_streamed:
+                    release(key)
+                else:
+                    complete(key, fingerprint, response.status_code, response.get_data(), response.content_type)
+                return response
+            except Exception:
+                release(key)
+                raise
+            finally:
+                with _inflight_lock:
+                    _inflight.pop(key, None)
+                event.set()
+        return wrapper
+    return decorator
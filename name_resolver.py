@@ -0,0 +1,193 @@
+# utils/name_resolver.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+
+
+class NameResolver:
+    """
+    Cache name -> ObjectId para colecciones que casi no cambian (apps, roles).
+    LRU acotado + TTL; los nombres desconocidos no se cachean.
+    Con nombres repetidos gana el primero por _id (como find_one del modelo). Con scope_field
+    (roles: app_id) resolve(name, scope=app) prefiere el documento de esa app y, si no hay,
+    el primero con ese nombre; `query` es el filtro base del modelo.
+    Con watch=True la primera resolución arranca watch_changes(), que invalida la cache
+    ante cualquier escritura en la colección (si no hay change streams, solo queda el TTL).
+    """
+
+    # espera antes de reintentar un change stream que falló
+    WATCH_RETRY_SECONDS = 60
+
+    def __init__(self, collection_getter, maxsize=1024, ttl=300, watch=True, scope_field=None, query=None):
+        self._collection_getter = collection_getter
+        self._scope_field = scope_field
+        self._query = query or {}
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._watch = watch
+        self._watch_thread = None
+        self._watch_retry_at = 0.0
+        self._entries = OrderedDict()   # (scope, name) -> (oid, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_cached(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        oid, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return oid
+
+    def _put(self, key, oid):
+        self._entries[key] = (oid, time.monotonic() + self._ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def resolve(self, name, scope=None):
+        if not name:
+            return None
+        return self.resolve_many([name], scope).get(name)
+
+    def resolve_many(self, names, scope=None):
+        """
+        Resuelve varios nombres con una sola consulta $in para los que no están en cache.
+        Devuelve {name: ObjectId} solo con los nombres encontrados.
+        """
+        scope = self._scope_key(scope)
+        found, missing = self._split_cached(names, scope)
+        if missing:
+            query, projection = self._lookup(missing)
+            self._store(self._collection_getter().find(query, projection).sort("_id", 1), found, scope)
+        return found
+
+    async def resolve_many_async(self, collection, names, scope=None):
+        # variante para el modo ASGI: misma cache, consulta con una colección Motor
+        scope = self._scope_key(scope)
+        found, missing = self._split_cached(names, scope)
+        if missing:
+            query, projection = self._lookup(missing)
+            self._store(await collection.find(query, projection).sort("_id", 1).to_list(None), found, scope)
+        return found
+
+    def _scope_key(self, scope):
+        return str(scope) if scope is not None and self._scope_field else None
+
+    def _lookup(self, names):
+        projection = {"_id": 1, "name": 1}
+        if self._scope_field:
+            projection[self._scope_field] = 1
+        return {**self._query, "name": {"$in": names}}, projection
+
+    def _split_cached(self, names, scope=None):
+        self._ensure_watching()
+        found, missing = {}, []
+        with self._lock:
+            for name in dict.fromkeys(n for n in names if n):
+                oid = self._get_cached((scope, name))
+                if oid is None:
+                    self.misses += 1
+                    missing.append(name)
+                else:
+                    self.hits += 1
+                    found[name] = oid
+        return found, missing
+
+    def _store(self, docs, found, scope=None):
+        # docs en orden de _id: primero el del scope pedido y, si no hay, el primero con ese nombre
+        scoped, first = {}, {}
+        for doc in docs:
+            first.setdefault(doc["name"], doc)
+            if scope is not None and str(doc.get(self._scope_field)) == scope:
+                scoped.setdefault(doc["name"], doc)
+        with self._lock:
+            for name, doc in {**first, **scoped}.items():
+                oid = ObjectId(str(doc["_id"]))
+                found[name] = oid
+                self._put((scope, name), oid)
+
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[1] == name]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+    def _ensure_watching(self):
+        if not self._watch or (self._watch_thread is not None and self._watch_thread.is_alive()):
+            return
+        with self._lock:
+            if (self._watch_thread is not None and self._watch_thread.is_alive()) or time.monotonic() < self._watch_retry_at:
+                return
+            self._watch_retry_at = time.monotonic() + self.WATCH_RETRY_SECONDS
+            self._watch_thread = self.watch_changes()
+
+    def watch_changes(self):
+        """
+        Invalida la cache ante cualquier escritura en la colección (change streams,
+        requiere replica set). Si no está disponible se depende solo del TTL.
+        """
+        def _run():
+            try:
+                with self._collection_getter().watch() as stream:
+                    for _ in stream:
+                        self.invalidate()
+            except Exception as e:
+                logging.warning(f"Name cache change stream unavailable, relying on TTL: {e}")
+            # pudo haber escrituras no vistas mientras el stream estaba caído
+            self.invalidate()
+
+        thread = threading.Thread(target=_run, name="name-resolver-watch", daemon=True)
+        thread.start()
+        return thread
+
+
+def _apps_collection():
+    from models.apps.db_queries import __dbmanager__
+    return __dbmanager__.collection
+
+
+def _roles_collection():
+    from models.role.db_queries import __dbmanager__
+    return __dbmanager__.collection
+
+
+app_names = NameResolver(_apps_collection)
+# los roles llevan app_id: el mismo nombre ("admin") se repite entre apps
+role_names = NameResolver(_roles_collection, scope_field="app_id")
+
+
+def invalidate_app_names(name=None):
+    # llamar desde los controladores que crean/renombran/eliminan apps
+    app_names.invalidate(name)
+
+
+def invalidate_role_names(name=None):
+    # llamar desde los controladores que crean/renombran/eliminan roles
+    role_names.invalidate(name)
+
+
+def name_cache_stats():
+    return {"apps": app_names.stats(), "roles": role_names.stats()}
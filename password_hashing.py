@@ -0,0 +1,202 @@
+# utils/password_hashing.py
+"""
+Servicio de hashing de contraseñas en un pool de procesos acotado, para que el costo
+de CPU del cifrado no bloquee los threads de requests baratos.
+
+Si hay más de max_pending operaciones en curso o en cola, se rechaza con HashingSaturated
+(el controlador responde 503) en vez de encolar sin límite. Un cupo se libera cuando la
+tarea termina en el pool, no cuando el request deja de esperarla (timeout).
+
+El enrollment masivo usa su propio pool (bulk_password_hasher, PASSWORD_HASH_BULK_WORKERS)
+para que una carga grande no deje sin workers a /user/password.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+_encryption = None
+
+
+def _encryption_util():
+    # una sola instancia de EncryptionUtil por proceso
+    global _encryption
+    if _encryption is None:
+        from utils.encryption_utils import EncryptionUtil
+        _encryption = EncryptionUtil()
+    return _encryption
+
+
+def default_encrypt(value):
+    return _encryption_util().encrypt(value)
+
+
+def default_verify(plain, hashed):
+    from models.user.user import UserModel
+    return UserModel.verify_password(plain, hashed)
+
+
+def _map_batch(fn, values):
+    # una tarea del pool para varios valores (encrypt_many)
+    return [fn(value) for value in values]
+
+
+class HashingSaturated(Exception):
+    pass
+
+
+class PasswordHasher:
+
+    def __init__(self, workers=2, max_pending=16, timeout=10.0, encrypt_fn=default_encrypt, verify_fn=default_verify,
+                 start_method="spawn"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.encrypt_fn = encrypt_fn
+        self.verify_fn = verify_fn
+        # spawn/forkserver: el proceso padre ya tiene threads (outbox, barrido), fork no es seguro
+        self.start_method = start_method
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method)
+                    )
+        return self._executor
+
+    def _submit_all(self, calls):
+        """
+        Envía [(fn, args), ...] al pool ocupando un solo cupo, que sigue ocupado mientras
+        alguna de esas tareas esté en el pool, aunque el request ya no las espere.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingSaturated("Password hashing capacity exhausted")
+        slots = self._slots
+        futures = []
+        try:
+            for fn, args in calls:
+                futures.append(self._pool().submit(fn, *args))
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            slots.release()
+            raise
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def _done(_):
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                slots.release()
+
+        for f in futures:
+            f.add_done_callback(_done)
+        return futures
+
+    def _submit(self, fn, *args):
+        return self._submit_all([(fn, args)])[0]
+
+    def _timed_out(self):
+        self.timeouts += 1
+        return HashingSaturated("Password hashing timed out")
+
+    def _run(self, fn, *args):
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise self._timed_out()
+
+    async def _run_async(self, fn, *args):
+        # modo ASGI: espera el resultado sin bloquear el event loop
+        future = self._submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise self._timed_out()
+
+    def encrypt(self, value):
+        return self._run(self.encrypt_fn, value)
+
+    def encrypt_many(self, values, slice_size=8, max_in_flight=None):
+        """
+        Cifra varios valores (enrollment masivo) en tandas de slice_size, con a lo sumo
+        max_in_flight tandas en el pool (por defecto, una por worker). Cada tanda ocupa un
+        cupo y su timeout es el de slice_size cifrados, no el del lote entero.
+        """
+        values = list(values)
+        max_in_flight = max(1, min(max_in_flight or self.workers, self.max_pending))
+        results, in_flight = [], deque()
+        try:
+            for start in range(0, len(values), slice_size):
+                if len(in_flight) >= max_in_flight:
+                    results.extend(self._slice_result(in_flight.popleft(), slice_size))
+                in_flight.append(self._submit(_map_batch, self.encrypt_fn, values[start:start + slice_size]))
+            while in_flight:
+                results.extend(self._slice_result(in_flight.popleft(), slice_size))
+        except BaseException:
+            for f in in_flight:
+                f.cancel()
+            raise
+        return results
+
+    def _slice_result(self, future, size):
+        try:
+            return future.result(timeout=self.timeout * size)
+        except FutureTimeout:
+            raise self._timed_out()
+
+    def verify(self, plain, hashed):
+        return self._run(self.verify_fn, plain, hashed)
+
+    async def encrypt_async(self, value):
+        return await self._run_async(self.encrypt_fn, value)
+
+    async def verify_async(self, plain, hashed):
+        return await self._run_async(self.verify_fn, plain, hashed)
+
+    def configure(self, **options):
+        # reconfigura (p. ej. en benchmarks); descarta el pool actual
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            for key, value in options.items():
+                setattr(self, key, value)
+            if "max_pending" in options:
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))),
+    max_pending=int(os.getenv("PASSWORD_HASH_MAX_PENDING", "16")),
+    timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "10")),
+    start_method=os.getenv("PASSWORD_HASH_START_METHOD", "spawn"),
+)
+
+# pool aparte para encrypt_many: compite por CPU, pero nunca por los workers ni los cupos
+# de los requests interactivos
+bulk_password_hasher = PasswordHasher(
+    workers=int(os.getenv("PASSWORD_HASH_BULK_WORKERS", "1")),
+    max_pending=int(os.getenv("PASSWORD_HASH_BULK_MAX_PENDING", "4")),
+    timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "10")),
+    start_method=os.getenv("PASSWORD_HASH_START_METHOD", "spawn"),
+)
@@ -0,0 +1,167 @@
+# utils/rate_limiter.py
+"""
+Rate limiting por IP y por email con token buckets, aplicado antes del handler:
+una petición rechazada no toca la base de datos.
+
+Por defecto los buckets viven en memoria (por proceso, en shards con lock propio).
+Con RATE_LIMIT_REDIS_URL se comparten entre workers vía Redis (dependencia opcional).
+"""
+import functools
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from http import HTTPStatus
+
+from flask import request
+
+from utils.server_response import ServerResponse, StatusCode
+
+# regla -> [(dimensión, capacidad, período en segundos)]
+RATE_LIMITS = {
+    "password_reset": [("ip", 10, 60), ("email", 3, 300)],
+    "password_change": [("ip", 20, 60), ("email", 5, 300)],
+    "verification": [("ip", 30, 60), ("email", 5, 300)],
+}
+
+
+class InMemoryBackend:
+    """
+    Buckets por proceso; también sirve de stand-in del backend compartido en pruebas.
+    Cada shard es un LRU con tope duro de claves: al pasarse se descarta la menos usada
+    (un bucket sin uso reciente ya se rellenó o está por hacerlo).
+    """
+
+    def __init__(self, shards=16, max_keys_per_shard=10000, clock=time.monotonic):
+        self._shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self._max_keys = max_keys_per_shard
+        self._clock = clock
+        self.evictions = 0
+        self.early_evictions = 0
+
+    def take(self, key, capacity, period):
+        """
+        Consume un token; devuelve 0 si se permitió o los segundos a esperar.
+        """
+        rate = capacity / period
+        lock, buckets = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        now = self._clock()
+        with lock:
+            # cada entrada guarda su propia capacidad y tasa (los shards mezclan reglas)
+            tokens, last, _, _ = buckets.get(key, (capacity, now, capacity, rate))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / rate
+            buckets[key] = (tokens - 1 if tokens >= 1 else tokens, now, capacity, rate)
+            buckets.move_to_end(key)
+            while len(buckets) > self._max_keys:
+                _, (old_tokens, old_last, old_capacity, old_rate) = buckets.popitem(last=False)
+                self.evictions += 1
+                if old_tokens + (now - old_last) * old_rate < old_capacity:
+                    # se descartó un bucket que aún limitaba: max_keys_per_shard es chico para el tráfico
+                    self.early_evictions += 1
+            return wait
+
+    def size(self):
+        return sum(len(buckets) for _, buckets in self._shards)
+
+
+class RedisBackend:
+    # buckets compartidos entre workers; el script Lua hace el refill+consumo atómico
+
+    _SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + (now - ts) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._SCRIPT)
+
+    def take(self, key, capacity, period):
+        return float(self._take(keys=[f"rl:{key}"], args=[capacity, capacity / period, time.time()]))
+
+
+class RateLimiter:
+
+    def __init__(self, backend=None, rules=None):
+        self.backend = backend or InMemoryBackend()
+        self.rules = dict(RATE_LIMITS if rules is None else rules)
+        self.rejected = 0
+
+    def check(self, rule, keys):
+        """
+        keys: {dimensión: valor}. Devuelve 0 si se permite o el Retry-After en segundos.
+        """
+        for dimension, capacity, period in self.rules.get(rule, []):
+            value = keys.get(dimension)
+            if not value:
+                continue
+            wait = self.backend.take(f"{rule}:{dimension}:{value}", capacity, period)
+            if wait:
+                self.rejected += 1
+                return wait
+        return 0
+
+
+def client_ip(remote_addr, forwarded_for=""):
+    # X-Forwarded-For solo con RATE_LIMIT_TRUST_PROXY=1 (detrás de un proxy propio)
+    if os.getenv("RATE_LIMIT_TRUST_PROXY") == "1" and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return remote_addr or ""
+
+
+def _client_ip():
+    return client_ip(request.remote_addr, request.headers.get("X-Forwarded-For", ""))
+
+
+def _build_limiter():
+    url = os.getenv("RATE_LIMIT_REDIS_URL")
+    return RateLimiter(RedisBackend(url) if url else InMemoryBackend())
+
+
+limiter = _build_limiter()
+
+
+def rate_limited(rule, email_field=None):
+    """
+    Decorador para métodos de Resource. email_field es el campo del body JSON
+    con el email a limitar (si la regla tiene dimensión 'email').
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            keys = {"ip": _client_ip()}
+            if email_field:
+                body = request.get_json(force=True, silent=True) or {}
+                email = body.get(email_field)
+                if isinstance(email, str):
+                    keys["email"] = email.strip().lower()
+
+            wait = limiter.check(rule, keys)
+            if wait:
+                response = ServerResponse(
+                    message="Too many requests, try again later.",
+                    status=HTTPStatus.TOO_MANY_REQUESTS
+                ).to_response()
+                if hasattr(response, "headers"):
+                    response.headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+                return response
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,278 @@
+# utils/request_metrics.py
+"""
+Instrumentación del hot path: cuenta y mide las llamadas a DB, modelos, correo y cifrado
+por request, y las expone como Server-Timing, log estructurado y /metrics (Prometheus).
+
+Registrar con init_app(app) y agregar MetricsController a la API.
+
+Los bytes devueltos se miden solo con METRICS_RESULT_BYTES=1 (re-serializa a BSON); en los
+cursores se estima con un documento de cada METRICS_CURSOR_SAMPLE.
+"""
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import bson
+from flask import g, has_request_context, request, Response
+from flask_restful import Resource
+
+logger = logging.getLogger("request_metrics")
+
+# buckets de latencia por ruta (segundos)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lock = threading.Lock()
+_route_histograms = {}                       # (method, route, status) -> [bucket counts..., sum, count]
+_component_totals = defaultdict(lambda: [0, 0.0, 0])   # component -> [calls, seconds, bytes]
+_gauge_providers = []                        # callables que devuelven {metric_name: value}
+
+RESULT_BYTES = os.getenv("METRICS_RESULT_BYTES") == "1"
+CURSOR_SAMPLE = max(1, int(os.getenv("METRICS_CURSOR_SAMPLE", "100")))
+
+
+def _result_size(result):
+    # tamaño BSON aproximado de lo devuelto (solo documentos y listas de documentos)
+    if not RESULT_BYTES:
+        return 0
+    try:
+        if isinstance(result, dict):
+            return len(bson.encode(result))
+        if isinstance(result, list):
+            return sum(len(bson.encode(d)) for d in result if isinstance(d, dict))
+    except Exception:
+        pass
+    return 0
+
+
+def _record(component, seconds, size):
+    with _lock:
+        totals = _component_totals[component]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += size
+    if has_request_context():
+        calls = g.setdefault("_hot_path_calls", {})
+        entry = calls.setdefault(component, [0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += size
+
+
+def _is_cursor(result):
+    # cursores de pymongo/mongomock (find, aggregate) y generadores: se consumen después
+    return callable(getattr(result, "__next__", None)) and callable(getattr(result, "close", None))
+
+
+class _InstrumentedCursor:
+    """
+    Los cursores son perezosos: el tiempo y los bytes se acumulan en cada next() y se
+    registran como una sola llamada al agotarse o cerrarse el cursor. Los bytes se estiman
+    muestreando un documento de cada CURSOR_SAMPLE (export y GET /user devuelven muchos).
+    """
+
+    def __init__(self, cursor, component, seconds):
+        self._cursor = cursor
+        self._component = component
+        self._seconds = seconds
+        self._size = 0
+        self._count = 0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            doc = next(self._cursor)
+        except BaseException:
+            self._seconds += time.perf_counter() - started
+            self._finish()
+            raise
+        self._seconds += time.perf_counter() - started
+        if RESULT_BYTES and self._count % CURSOR_SAMPLE == 0:
+            self._size += _result_size(doc) * CURSOR_SAMPLE
+        self._count += 1
+        return doc
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            _record(self._component, self._seconds, self._size)
+
+    def close(self):
+        self._finish()
+        return self._cursor.close()
+
+    def __getattr__(self, name):
+        value = getattr(self._cursor, name)
+        if not inspect.isroutine(value):
+            return value
+
+        def wrapper(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # sort()/limit()/batch_size()... devuelven el mismo cursor
+            return self if result is self._cursor else result
+
+        return wrapper
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class _Instrumented:
+    """
+    Proxy que mide cada método llamado sobre el objeto envuelto. Si el objeto es una clase,
+    las instancias creadas también quedan instrumentadas.
+    """
+
+    def __init__(self, target, component, nested=()):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_component", component)
+        object.__setattr__(self, "_nested", nested)
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in self._nested:
+            return _Instrumented(value, f"{self._component}.{name}")
+        # solo funciones/métodos: objetos invocables como pymongo Database (define __call__)
+        # se devuelven tal cual para no perder su interfaz
+        if not inspect.isroutine(value):
+            return value
+        component = f"{self._component}.{name}"
+
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            result = value(*args, **kwargs)
+            if _is_cursor(result):
+                return _InstrumentedCursor(result, component, time.perf_counter() - started)
+            _record(component, time.perf_counter() - started, _result_size(result))
+            return result
+
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+    def __call__(self, *args, **kwargs):
+        result = self._target(*args, **kwargs)
+        if isinstance(self._target, type):
+            return _Instrumented(result, self._component)
+        return result
+
+
+def instrument(target, component, nested=()):
+    return _Instrumented(target, component, nested)
+
+
+def register_gauges(provider):
+    # provider() -> {"metric_name": value}; se publica en /metrics
+    _gauge_providers.append(provider)
+
+
+def _server_timing(calls, total):
+    parts = [
+        f'{component.replace(".", "-")};dur={seconds * 1000:.2f};desc="x{count}"'
+        for component, (count, seconds, _) in sorted(calls.items())
+    ]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def _observe_route(method, route, status, seconds):
+    key = (method, route, status)
+    with _lock:
+        hist = _route_histograms.get(key)
+        if hist is None:
+            hist = _route_histograms[key] = [0] * len(BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+def init_app(app):
+    @app.before_request
+    def _start_timer():
+        g._hot_path_started = time.perf_counter()
+        g._hot_path_calls = {}
+
+    @app.after_request
+    def _emit(response):
+        started = g.get("_hot_path_started")
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        calls = g.get("_hot_path_calls") or {}
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        _observe_route(request.method, route, response.status_code, total)
+        # en las rutas con respuesta streamed (GET /user, export) esto se emite antes de consumir
+        # el cursor: Server-Timing muestra ~0 ms de DB; el tiempo real queda en /metrics y en el
+        # componente del cursor cuando se agota
+        response.headers["Server-Timing"] = _server_timing(calls, total)
+        logger.info(json.dumps({
+            "method": request.method,
+            "route": route,
+            "status": response.status_code,
+            "duration_ms": round(total * 1000, 3),
+            "calls": {c: {"count": n, "ms": round(s * 1000, 3), "bytes": b} for c, (n, s, b) in calls.items()},
+        }))
+        return response
+
+    return app
+
+
+def render_metrics():
+    lines = [
+        "# HELP http_request_duration_seconds Request latency per route.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    with _lock:
+        histograms = {k: list(v) for k, v in _route_histograms.items()}
+        totals = {k: list(v) for k, v in _component_totals.items()}
+
+    for (method, route, status), hist in sorted(histograms.items()):
+        labels = f'method="{method}",route="{route}",status="{status}"'
+        for bound, count in zip(BUCKETS, hist):
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {hist[-1]}')
+        lines.append(f"http_request_duration_seconds_sum{{{labels}}} {hist[-2]:.6f}")
+        lines.append(f"http_request_duration_seconds_count{{{labels}}} {hist[-1]}")
+
+    lines += [
+        "# HELP hot_path_calls_total Calls to instrumented DB/model/email/encryption components.",
+        "# TYPE hot_path_calls_total counter",
+    ]
+    lines += [f'hot_path_calls_total{{component="{c}"}} {t[0]}' for c, t in sorted(totals.items())]
+    lines += ["# TYPE hot_path_seconds_total counter"]
+    lines += [f'hot_path_seconds_total{{component="{c}"}} {t[1]:.6f}' for c, t in sorted(totals.items())]
+    lines += ["# TYPE hot_path_bytes_total counter"]
+    lines += [f'hot_path_bytes_total{{component="{c}"}} {t[2]}' for c, t in sorted(totals.items())]
+
+    for provider in _gauge_providers:
+        try:
+            for name, value in provider().items():
+                lines.append(f"{name} {value}")
+        except Exception as e:
+            logger.warning(f"Gauge provider failed: {e}")
+
+    return "\n".join(lines) + "\n"
+
+
+# =========================================
+# GET /metrics
+# =========================================
+class MetricsController(Resource):
+    route = '/metrics'
+
+    def get(self):
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
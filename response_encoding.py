@@ -0,0 +1,70 @@
+# utils/response_encoding.py
+"""
+Serialización JSON rápida para respuestas con documentos de Mongo.
+
+ObjectId -> str y datetime -> ISO 8601 se codifican directamente, sin pasar por el
+encoder genérico. Usa orjson si está instalado (RESPONSE_JSON_BACKEND=json lo desactiva).
+"""
+import json
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dumps_orjson(obj):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _dumps_json(obj):
+    return json.dumps(obj, default=_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+_backends = {"json": _dumps_json}
+if orjson is not None:
+    _backends["orjson"] = _dumps_orjson
+
+_dumps = _dumps_orjson if orjson is not None and os.getenv("RESPONSE_JSON_BACKEND") != "json" else _dumps_json
+
+
+def set_backend(name):
+    global _dumps
+    _dumps = _backends[name]
+
+
+def register_backend(name, dumps):
+    # dumps(obj) -> bytes
+    _backends[name] = dumps
+
+
+def dumps(obj):
+    return _dumps(obj)
+
+
+def public_document(doc):
+    """
+    _id -> id en el mismo dict (sin copiar): los documentos del cursor son propios del request.
+    """
+    if doc is not None and "_id" in doc:
+        doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+def json_response(data=None, message=None, message_code=None, status=200):
+    # mismo sobre que ServerResponse (message, message_code, data)
+    body = {"message": message, "message_code": message_code, "data": data}
+    return Response(dumps(body), status=int(getattr(status, "value", status)), mimetype="application/json")
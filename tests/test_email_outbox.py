@@ -0,0 +1,157 @@
+# tests/test_email_outbox.py
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+from utils.email_outbox import EmailOutbox, SmtpSender
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+
+class _RecordingHandler:
+    # servidor SMTP falso: guarda cada mensaje; puede rechazar los primeros o bloquearse
+
+    def __init__(self, reject_first=0, hold=None):
+        self.messages = []
+        self.attempts = 0
+        self.reject_first = reject_first
+        self.hold = hold   # threading.Event: el primer DATA espera hasta que se active
+
+    async def handle_DATA(self, server, session, envelope):
+        self.attempts += 1
+        if self.hold is not None and self.attempts == 1:
+            await asyncio.get_running_loop().run_in_executor(None, self.hold.wait, 5)
+        if self.attempts <= self.reject_first:
+            return "451 Try again later"
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode("utf-8", "replace")))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(handler):
+        port = _free_port()
+        controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+        controller.start()
+        servers.append(controller)
+        return SmtpSender(host="127.0.0.1", port=port)
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def test_codes_for_same_recipient_are_sent_in_one_message(smtp_server):
+    hold = threading.Event()
+    handler = _RecordingHandler(hold=hold)
+    outbox = EmailOutbox(sender=smtp_server(handler), workers=1, backoff=0.01)
+
+    # el único worker queda ocupado con el primer envío mientras se encolan los demás
+    outbox.enqueue_codes("first@example.com", ["000000"])
+    outbox.enqueue_codes("user@example.com", ["111111"])
+    outbox.enqueue_codes("user@example.com", ["222222"])
+    hold.set()
+
+    assert outbox.flush(timeout=10)
+    to_user = [body for rcpt, body in handler.messages if rcpt == ["user@example.com"]]
+    assert len(to_user) == 1
+    assert "111111" in to_user[0] and "222222" in to_user[0]
+
+
+def test_transient_smtp_failure_is_retried(smtp_server):
+    handler = _RecordingHandler(reject_first=2)
+    outbox = EmailOutbox(sender=smtp_server(handler), workers=1, max_retries=3, backoff=0.01)
+
+    outbox.enqueue_new_password("user@example.com", "Temp-Passw0rd")
+
+    assert outbox.flush(timeout=10)
+    assert handler.attempts == 3
+    assert len(handler.messages) == 1
+    assert "Temp-Passw0rd" in handler.messages[0][1]
+
+
+def test_gives_up_after_max_retries(smtp_server):
+    handler = _RecordingHandler(reject_first=10)
+    outbox = EmailOutbox(sender=smtp_server(handler), workers=1, max_retries=2, backoff=0.01)
+
+    outbox.enqueue_codes("user@example.com", ["123456"])
+
+    assert outbox.flush(timeout=10)
+    assert handler.attempts == 3
+    assert handler.messages == []
+
+
+def test_full_queue_falls_back_to_synchronous_send(smtp_server):
+    hold = threading.Event()
+    handler = _RecordingHandler(hold=hold)
+    outbox = EmailOutbox(sender=smtp_server(handler), workers=1, max_queue=1, backoff=0.01)
+
+    outbox.enqueue_codes("first@example.com", ["000000"])     # lo toma el worker (bloqueado)
+    _wait_until(lambda: handler.attempts == 1)
+    outbox.enqueue_codes("queued@example.com", ["111111"])    # ocupa la cola
+    threading.Timer(0.2, hold.set).start()
+    outbox.enqueue_codes("sync@example.com", ["222222"])      # cola llena: envío en este thread
+
+    assert any(rcpt == ["sync@example.com"] for rcpt, _ in handler.messages)
+    assert outbox.flush(timeout=10)
+    assert len(handler.messages) == 3
+
+
+def test_synchronous_fallback_is_a_single_attempt(smtp_server):
+    hold = threading.Event()
+    handler = _RecordingHandler(hold=hold, reject_first=3)
+    outbox = EmailOutbox(sender=smtp_server(handler), workers=1, max_queue=1, max_retries=3, backoff=1.0)
+
+    outbox.enqueue_codes("first@example.com", ["000000"])
+    _wait_until(lambda: handler.attempts == 1)
+    outbox.enqueue_codes("queued@example.com", ["111111"])
+    hold.set()
+    started = time.monotonic()
+    outbox.enqueue_new_password("sync@example.com", "Temp-Passw0rd")   # rechazado: no se reintenta
+
+    assert time.monotonic() - started < 1.0
+    assert not any(rcpt == ["sync@example.com"] for rcpt, _ in handler.messages)
+
+
+class _FakeEmailManager:
+    def __init__(self, multi=False):
+        self.sent = []
+        if multi:
+            self.send_email_codes = lambda recipient, codes: self.sent.append(("many", recipient, list(codes)))
+
+    def send_email(self, recipient, code):
+        self.sent.append(("one", recipient, code))
+
+
+@pytest.mark.parametrize("multi", [True, False])
+def test_email_manager_sender_never_joins_codes_into_one_template(monkeypatch, multi):
+    from utils import email_outbox
+
+    fake = _FakeEmailManager(multi)
+    monkeypatch.setattr(email_outbox, "email_manager", fake)
+    monkeypatch.setattr(email_outbox, "send_email", fake.send_email)
+
+    email_outbox.EmailManagerSender().send_codes("user@example.com", ["111111", "222222"])
+
+    if multi:
+        assert fake.sent == [("many", "user@example.com", ["111111", "222222"])]
+    else:
+        assert fake.sent == [("one", "user@example.com", "111111"), ("one", "user@example.com", "222222")]
@@ -0,0 +1,146 @@
+# tests/test_idempotency.py
+import json
+import threading
+import time
+
+import pytest
+
+from flask import Flask
+from flask_restful import Api, Resource
+
+from utils import idempotency
+from utils.idempotency import InMemoryStore, idempotent
+
+
+@pytest.fixture
+def handler_state():
+    return {"calls": 0, "gate": None, "entered": threading.Event(), "status": 200}
+
+
+@pytest.fixture
+def client(monkeypatch, handler_state):
+    monkeypatch.setattr(idempotency, "store", InMemoryStore())
+
+    class _Enroll(Resource):
+        @idempotent("test")
+        def post(self):
+            handler_state["calls"] += 1
+            handler_state["entered"].set()
+            if handler_state["gate"] is not None:
+                handler_state["gate"].wait(5)
+            return {"call": handler_state["calls"]}, handler_state["status"]
+
+    app = Flask(__name__)
+    Api(app).add_resource(_Enroll, "/enroll")
+    return app
+
+
+def _post(app, key=None, body=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    data = json.dumps(body or {"email": "a@example.com"})
+    return app.test_client().post("/enroll", data=data, content_type="application/json", headers=headers)
+
+
+def test_without_key_every_request_runs(client, handler_state):
+    _post(client)
+    _post(client)
+
+    assert handler_state["calls"] == 2
+
+
+def test_retry_is_replayed(client, handler_state):
+    first = _post(client, "k1")
+    retry = _post(client, "k1")
+
+    assert handler_state["calls"] == 1
+    assert retry.status_code == first.status_code
+    assert retry.get_data() == first.get_data()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+
+
+def test_key_reused_with_different_body_is_rejected(client, handler_state):
+    _post(client, "k1", {"email": "a@example.com"})
+    response = _post(client, "k1", {"email": "b@example.com"})
+
+    assert response.status_code == 409
+    assert handler_state["calls"] == 1
+
+
+def test_concurrent_requests_are_coalesced(client, handler_state):
+    handler_state["gate"] = threading.Event()
+    responses = []
+
+    def send():
+        responses.append(_post(client, "k1"))
+
+    first = threading.Thread(target=send)
+    first.start()
+    assert handler_state["entered"].wait(5)
+    second = threading.Thread(target=send)
+    second.start()
+    time.sleep(0.1)
+    handler_state["gate"].set()
+    first.join(5)
+    second.join(5)
+
+    assert handler_state["calls"] == 1
+    assert len(responses) == 2
+    assert responses[0].get_data() == responses[1].get_data()
+    assert sum(r.headers.get("Idempotent-Replayed") == "true" for r in responses) == 1
+
+
+def test_server_error_releases_the_key(client, handler_state):
+    handler_state["status"] = 500
+    assert _post(client, "k1").status_code == 500
+
+    handler_state["status"] = 200
+    response = _post(client, "k1")
+
+    assert response.status_code == 200
+    assert handler_state["calls"] == 2
+
+
+def test_abandoned_pending_key_expires_after_the_lease(client, handler_state, monkeypatch):
+    monkeypatch.setattr(idempotency, "PENDING_LEASE", 0.1)
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT", 1.0)
+    # un worker que tomó la clave y murió sin responder
+    key, fingerprint = idempotency.request_key("test", "k1", json.dumps({"email": "a@example.com"}).encode())
+    assert idempotency.claim(key, fingerprint)
+
+    response = _post(client, "k1")
+
+    assert response.status_code == 200
+    assert handler_state["calls"] == 1
+
+
+def test_replay_is_not_rate_limited(monkeypatch):
+    from utils import rate_limiter
+    from utils.rate_limiter import InMemoryBackend, RateLimiter, rate_limited
+
+    monkeypatch.setattr(idempotency, "store", InMemoryStore())
+    monkeypatch.setattr(rate_limiter, "limiter", RateLimiter(InMemoryBackend(), rules={"reset": [("email", 1, 300)]}))
+    calls = []
+
+    class _Reset(Resource):
+        @idempotent("reset")
+        @rate_limited("reset", email_field="email")
+        def post(self):
+            calls.append(1)
+            return {"ok": True}, 200
+
+    app = Flask(__name__)
+    Api(app).add_resource(_Reset, "/reset")
+
+    def post(key):
+        return app.test_client().post("/reset", data=json.dumps({"email": "a@example.com"}),
+                                      content_type="application/json", headers={"Idempotency-Key": key})
+
+    assert post("k1").status_code == 200
+    retries = [post("k1") for _ in range(3)]
+    assert all(r.status_code == 200 and r.headers["Idempotent-Replayed"] == "true" for r in retries)
+
+    # una clave nueva sí se limita, y el 429 no queda guardado
+    assert post("k2").status_code == 429
+    key, fingerprint = idempotency.request_key("reset", "k2", json.dumps({"email": "a@example.com"}).encode())
+    assert idempotency.check(key, fingerprint) == (None, None)
+    assert len(calls) == 1
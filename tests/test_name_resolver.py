@@ -0,0 +1,66 @@
+# tests/test_name_resolver.py
+from bson import ObjectId
+
+from utils.name_resolver import NameResolver
+
+
+class _Cursor(list):
+    def sort(self, key, direction):
+        return _Cursor(sorted(self, key=lambda d: d[key], reverse=direction < 0))
+
+
+class _Collection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        names = query["name"]["$in"]
+        # orden de inserción distinto del orden por _id
+        return _Cursor(reversed([d for d in self.docs if d["name"] in names]))
+
+
+def _resolver(docs, **kwargs):
+    collection = _Collection(docs)
+    return NameResolver(lambda: collection, watch=False, **kwargs), collection
+
+
+def test_duplicate_names_resolve_to_the_first_document():
+    first, second = ObjectId(), ObjectId()
+    resolver, _ = _resolver([{"_id": first, "name": "admin"}, {"_id": second, "name": "admin"}])
+
+    assert resolver.resolve("admin") == first
+
+
+def test_roles_are_scoped_by_app():
+    app_a, app_b = ObjectId(), ObjectId()
+    role_a, role_b, global_role = ObjectId(), ObjectId(), ObjectId()
+    resolver, _ = _resolver([
+        {"_id": role_a, "name": "admin", "app_id": str(app_a)},
+        {"_id": role_b, "name": "admin", "app_id": app_b},
+        {"_id": global_role, "name": "viewer"},
+    ], scope_field="app_id")
+
+    assert resolver.resolve("admin", app_a) == role_a
+    assert resolver.resolve("admin", app_b) == role_b
+    # sin rol propio de la app se usa el primero con ese nombre
+    assert resolver.resolve("viewer", app_a) == global_role
+
+
+def test_scopes_are_cached_separately_and_base_query_is_applied():
+    app_a, app_b = ObjectId(), ObjectId()
+    role_a, role_b = ObjectId(), ObjectId()
+    resolver, collection = _resolver([
+        {"_id": role_a, "name": "admin", "app_id": app_a},
+        {"_id": role_b, "name": "admin", "app_id": app_b},
+    ], scope_field="app_id", query={"deleted": {"$ne": True}})
+
+    assert resolver.resolve("admin", app_a) == role_a
+    assert resolver.resolve("admin", app_a) == role_a
+    assert resolver.resolve("admin", app_b) == role_b
+    assert len(collection.queries) == 2
+    assert all(q["deleted"] == {"$ne": True} for q in collection.queries)
+
+    resolver.invalidate("admin")
+    assert resolver.stats()["size"] == 0
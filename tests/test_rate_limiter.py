@@ -0,0 +1,117 @@
+# tests/test_rate_limiter.py
+import pytest
+
+from flask import Flask
+from flask_restful import Api, Resource
+
+from utils import rate_limiter
+from utils.rate_limiter import InMemoryBackend, RateLimiter, rate_limited
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+def test_bucket_rejects_after_capacity_and_reports_wait(clock):
+    backend = InMemoryBackend(clock=clock)
+
+    assert [backend.take("k", 3, 60) for _ in range(3)] == [0, 0, 0]
+    # 3 tokens por minuto: el siguiente llega en 20 s
+    assert backend.take("k", 3, 60) == pytest.approx(20.0)
+
+
+def test_bucket_refills_over_time(clock):
+    backend = InMemoryBackend(clock=clock)
+    for _ in range(3):
+        backend.take("k", 3, 60)
+
+    clock.now += 20
+    assert backend.take("k", 3, 60) == 0
+    assert backend.take("k", 3, 60) > 0
+
+    clock.now += 600
+    assert [backend.take("k", 3, 60) for _ in range(3)] == [0, 0, 0]
+
+
+def test_keys_are_limited_independently(clock):
+    backend = InMemoryBackend(clock=clock)
+    backend.take("a", 1, 60)
+
+    assert backend.take("a", 1, 60) > 0
+    assert backend.take("b", 1, 60) == 0
+
+
+def test_shard_size_is_capped_with_lru_eviction(clock):
+    backend = InMemoryBackend(shards=1, max_keys_per_shard=100, clock=clock)
+    for i in range(1000):
+        backend.take(f"ip:{i}", 30, 60)
+
+    assert backend.size() == 100
+    assert backend.evictions == 900
+
+
+def test_eviction_does_not_mix_rule_capacities(clock):
+    # un bucket de capacidad alta no se evalúa con la capacidad de otra regla
+    backend = InMemoryBackend(shards=1, max_keys_per_shard=2, clock=clock)
+    for _ in range(10):
+        backend.take("verification:ip:1", 30, 60)
+    backend.take("password_reset:email:a", 3, 300)
+
+    assert backend.size() == 2
+    assert backend.take("verification:ip:1", 30, 60) == 0
+    assert backend.evictions == 0
+
+
+def test_limiter_checks_every_dimension(clock):
+    limiter = RateLimiter(InMemoryBackend(clock=clock), rules={"r": [("ip", 10, 60), ("email", 1, 60)]})
+
+    assert limiter.check("r", {"ip": "1.1.1.1", "email": "a@example.com"}) == 0
+    assert limiter.check("r", {"ip": "1.1.1.1", "email": "a@example.com"}) > 0
+    assert limiter.check("r", {"ip": "1.1.1.1", "email": "b@example.com"}) == 0
+    assert limiter.rejected == 1
+
+
+def test_limiter_without_rules_allows_everything():
+    limiter = RateLimiter(InMemoryBackend(), rules={})
+
+    assert all(limiter.check("password_reset", {"ip": "1.1.1.1"}) == 0 for _ in range(100))
+
+
+@pytest.fixture
+def client(monkeypatch, clock):
+    monkeypatch.setattr(rate_limiter, "limiter",
+                        RateLimiter(InMemoryBackend(clock=clock), rules={"reset": [("email", 2, 60)]}))
+    calls = []
+
+    class _Reset(Resource):
+        @rate_limited("reset", email_field="email")
+        def post(self):
+            calls.append(1)
+            return {"ok": True}
+
+    app = Flask(__name__)
+    Api(app).add_resource(_Reset, "/reset")
+    test_client = app.test_client()
+    test_client.calls = calls
+    return test_client
+
+
+def test_decorator_returns_429_with_retry_after(client):
+    for _ in range(2):
+        assert client.post("/reset", json={"email": "User@Example.com"}).status_code == 200
+
+    response = client.post("/reset", json={"email": "user@example.com "})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    # la petición rechazada no llega al handler
+    assert len(client.calls) == 2
@@ -0,0 +1,73 @@
+# tests/test_user_cache.py
+from models.user.cache import UserDocumentCache
+
+
+def _doc(id, email):
+    return {"_id": id, "email": email, "password": "hash", "apps": [{"app": "a", "code": "123456", "token": "t"}]}
+
+
+class _Loader:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = 0
+
+    def __call__(self, key):
+        self.calls += 1
+        return self.docs.get(key)
+
+
+def test_hits_skip_the_loader_and_sensitive_fields_are_dropped():
+    cache = UserDocumentCache(maxsize=10, ttl=60)
+    loader = _Loader({"1": _doc("1", "ana@example.com")})
+
+    first = cache.get_by_id("1", loader)
+    second = cache.get_by_id("1", loader)
+
+    assert loader.calls == 1
+    assert first == second == {"_id": "1", "email": "ana@example.com", "apps": [{"app": "a"}]}
+    # el email indexa la misma entrada
+    assert cache.get_by_email("ana@example.com", loader) == first
+    assert loader.calls == 1
+
+
+def test_invalidate_by_id_email_or_any_other_filter():
+    cache = UserDocumentCache(maxsize=10, ttl=60)
+    loader = _Loader({"1": _doc("1", "ana@example.com"), "2": _doc("2", "eva@example.com")})
+    cache.get_by_id("1", loader)
+    cache.get_by_id("2", loader)
+
+    cache.invalidate({"_id": {"$in": ["1"]}})
+    assert cache.stats()["size"] == 1
+    cache.invalidate({"email": "eva@example.com"})
+    assert cache.stats()["size"] == 0
+
+    cache.get_by_id("1", loader)
+    cache.invalidate({"apps.app": "a"})
+    assert cache.stats()["size"] == 0
+
+
+def test_lru_eviction_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("models.user.cache.time.monotonic", lambda: now[0])
+    cache = UserDocumentCache(maxsize=2, ttl=5)
+    loader = _Loader({k: _doc(k, f"{k}@example.com") for k in "123"})
+
+    for key in "123":
+        cache.get_by_id(key, loader)
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_by_email("1@example.com", lambda email: None) is None
+
+    now[0] += 6
+    cache.get_by_id("3", loader)
+    assert loader.calls == 4
+
+
+def test_write_during_load_is_not_cached():
+    cache = UserDocumentCache(maxsize=10, ttl=60)
+
+    def loader(id):
+        cache.invalidate({"_id": id})
+        return _doc(id, "ana@example.com")
+
+    cache.get_by_id("1", loader)
+    assert cache.stats()["size"] == 0
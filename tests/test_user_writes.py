@@ -0,0 +1,148 @@
+# tests/test_user_writes.py
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from bson import ObjectId
+
+from models.user import indexes, memberships
+from models.user.writes import change_role_for_app, enroll_user
+
+
+def _collection(unique=True):
+    collection = mongomock.MongoClient().db.users
+    if unique:
+        collection.create_index("email", unique=True, name="email_unique")
+    return collection
+
+
+def _assignment(role, app):
+    return {"role": role, "app": app, "code": "123456", "status": "Pending"}
+
+
+class _Encrypt:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, password):
+        self.calls += 1
+        return f"hashed:{password}"
+
+
+@pytest.fixture
+def email_unique(monkeypatch):
+    monkeypatch.setattr(indexes, "_created", {"email_unique"})
+
+
+def test_new_user_is_inserted_with_the_hash(email_unique):
+    collection, encrypt = _collection(), _Encrypt()
+    role, app = ObjectId(), ObjectId()
+
+    assert enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app)], encrypt) == (True, None)
+
+    doc = collection.find_one({"email": "ana@example.com"})
+    assert doc["password"] == "hashed:secret"
+    assert [(a["role"], a["app"]) for a in doc["apps"]] == [(role, app)]
+
+
+def test_existing_user_gets_the_push_without_hashing(email_unique):
+    collection, encrypt = _collection(), _Encrypt()
+    role, app_a, app_b = ObjectId(), ObjectId(), ObjectId()
+    enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app_a)], encrypt)
+
+    assert enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app_b)], encrypt) == (False, None)
+
+    assert encrypt.calls == 1
+    assert len(collection.find_one({"email": "ana@example.com"})["apps"]) == 2
+
+
+def test_duplicate_pair_is_reported_without_hashing_or_writing(email_unique):
+    collection, encrypt = _collection(), _Encrypt()
+    role, app = ObjectId(), ObjectId()
+    enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app)], encrypt)
+
+    created, dup = enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app)], encrypt)
+
+    assert (created, dup["role"], dup["app"]) == (False, role, app)
+    assert encrypt.calls == 1
+    assert len(collection.find_one({"email": "ana@example.com"})["apps"]) == 1
+
+
+def test_without_email_unique_falls_back_to_find_then_insert(monkeypatch):
+    monkeypatch.setattr(indexes, "_created", set())
+    collection, encrypt = _collection(unique=False), _Encrypt()
+    role, app = ObjectId(), ObjectId()
+
+    assert enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app)], encrypt) == (True, None)
+    created, dup = enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app)], encrypt)
+
+    assert not created and dup is not None
+    assert collection.count_documents({"email": "ana@example.com"}) == 1
+
+
+def test_insert_race_becomes_a_push(email_unique, monkeypatch):
+    collection, encrypt = _collection(), _Encrypt()
+    role, app_a, app_b = ObjectId(), ObjectId(), ObjectId()
+    find_one = collection.find_one
+
+    def find_one_racing(query, *args, **kwargs):
+        # la primera lectura no ve al usuario; otra petición lo crea antes del insert
+        monkeypatch.setattr(collection, "find_one", find_one)
+        collection.insert_one({"email": "ana@example.com", "name": "Ana", "apps": [_assignment(role, app_a)]})
+        return None
+
+    monkeypatch.setattr(collection, "find_one", find_one_racing)
+
+    assert enroll_user(collection, "Ana", "ana@example.com", "secret", [_assignment(role, app_b)], encrypt) == (False, None)
+    assert len(find_one({"email": "ana@example.com"})["apps"]) == 2
+
+
+def _roles(collection, user_id, app):
+    return sorted(str(a["role"]) for a in collection.find_one({"_id": user_id})["apps"] if a["app"] == app)
+
+
+@pytest.fixture
+def two_roles(monkeypatch):
+    # usuario con la misma app bajo dos roles
+    monkeypatch.setattr(memberships, "enabled", lambda: False)
+    collection = _collection()
+    app, viewer, editor = ObjectId(), ObjectId(), ObjectId()
+    user_id = collection.insert_one({"email": "ana@example.com", "apps": [
+        _assignment(viewer, app), _assignment(editor, app)
+    ]}).inserted_id
+    return collection, user_id, app, viewer, editor
+
+
+def test_role_held_under_another_element_is_not_duplicated(two_roles):
+    collection, user_id, app, viewer, editor = two_roles
+    query = {"_id": {"$in": [user_id]}}
+
+    result = change_role_for_app(collection, app, query, {"app": app}, {"role": editor})
+
+    assert result.matched_count == 0
+    assert query["_id"] == {"$in": []}
+    assert _roles(collection, user_id, app) == sorted([str(viewer), str(editor)])
+
+
+def test_new_role_replaces_only_the_first_matching_element(two_roles):
+    collection, user_id, app, viewer, editor = two_roles
+    admin = ObjectId()
+
+    result = change_role_for_app(collection, app, {}, {"app": app}, {"role": admin, "status": "Active"})
+
+    assert result.modified_count == 1
+    assert _roles(collection, user_id, app) == sorted([str(admin), str(editor)])
+
+
+def test_role_filter_selects_the_element_to_change(two_roles):
+    collection, user_id, app, viewer, editor = two_roles
+    admin = ObjectId()
+    other = collection.insert_one({"email": "eva@example.com", "apps": [_assignment(admin, app)]}).inserted_id
+    query = {}
+
+    change_role_for_app(collection, app, query, {"app": app, "role": editor}, {"role": admin})
+
+    # quien ya tenía el par queda excluido por _id, no con un segundo predicado sobre apps
+    assert query["_id"] == {"$nin": [other]}
+    assert set(query) == {"_id", "apps"}
+    assert _roles(collection, user_id, app) == sorted([str(viewer), str(admin)])
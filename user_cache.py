@@ -0,0 +1,154 @@
+# models/user/cache.py
+"""
+Cache read-through opcional (USER_DOC_CACHE=1) de documentos de usuario por id y email,
+para GET /user/<id> y las búsquedas por email que no necesitan la contraseña.
+
+LRU acotado (USER_DOC_CACHE_SIZE) + TTL (USER_DOC_CACHE_TTL, segundos). Las entradas se
+guardan sin password ni apps[].code / apps[].token. Toda escritura de usuarios pasa por
+invalidate(); la invalidación es por proceso, así que entre workers el TTL acota lo viejo.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SENSITIVE_FIELDS = ("password",)
+SENSITIVE_APP_FIELDS = ("code", "token")
+
+
+def _sanitize(doc):
+    clean = {k: v for k, v in doc.items() if k not in SENSITIVE_FIELDS}
+    if isinstance(clean.get("apps"), list):
+        clean["apps"] = [
+            {k: v for k, v in app.items() if k not in SENSITIVE_APP_FIELDS} if isinstance(app, dict) else app
+            for app in clean["apps"]
+        ]
+    return clean
+
+
+class UserDocumentCache:
+
+    def __init__(self, maxsize=10000, ttl=30, enabled=True):
+        self.enabled = enabled
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()   # str(_id) -> (doc, expires_at)
+        self._by_email = {}             # email -> str(_id)
+        self._generation = 0            # cambia en cada invalidación
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_by_id(self, id, loader):
+        """
+        loader(id) -> documento | None; el resultado va sin campos sensibles.
+        """
+        return self._get(str(id), None, lambda: loader(id))
+
+    def get_by_email(self, email, loader):
+        return self._get(None, email, lambda: loader(email))
+
+    def _get(self, key, email, load):
+        if not self.enabled:
+            doc = load()
+            return _sanitize(doc) if isinstance(doc, dict) else doc
+
+        with self._lock:
+            if key is None:
+                key = self._by_email.get(email)
+            doc = self._lookup(key) if key is not None else None
+            if doc is not None:
+                self.hits += 1
+                return dict(doc)
+            self.misses += 1
+            generation = self._generation
+
+        loaded = load()
+        if not isinstance(loaded, dict):
+            return loaded
+        doc = _sanitize(loaded)
+        with self._lock:
+            # si hubo una escritura mientras se leía, no se cachea lo leído
+            if generation == self._generation:
+                self._put(doc)
+        return dict(doc)
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        doc, expires_at = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return doc
+
+    def _put(self, doc):
+        key = str(doc["_id"])
+        self._remove(key)
+        self._entries[key] = (doc, time.monotonic() + self._ttl)
+        if doc.get("email"):
+            self._by_email[doc["email"]] = key
+        while len(self._entries) > self._maxsize:
+            old_key, (old_doc, _) = self._entries.popitem(last=False)
+            self._by_email.pop(old_doc.get("email"), None)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._by_email.pop(entry[0].get("email"), None)
+
+    def invalidate(self, query=None):
+        """
+        Recibe el mismo filtro usado en la escritura. Entiende _id / email por igualdad o $in;
+        cualquier otro filtro (o None) vacía la cache.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            query = query or {}
+            ids = self._values(query.get("_id"))
+            emails = self._values(query.get("email"))
+            if ids is None and emails is None:
+                self._entries.clear()
+                self._by_email.clear()
+                return
+            for id in ids or []:
+                self._remove(str(id))
+            for email in emails or []:
+                key = self._by_email.get(email)
+                if key is not None:
+                    self._remove(key)
+
+    @staticmethod
+    def _values(condition):
+        if condition is None:
+            return None
+        if isinstance(condition, dict):
+            return list(condition["$in"]) if set(condition) == {"$in"} else None
+        return [condition]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": (self.hits / total) if total else 0.0,
+            }
+
+
+user_cache = UserDocumentCache(
+    maxsize=int(os.getenv("USER_DOC_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("USER_DOC_CACHE_TTL", "30")),
+    enabled=os.getenv("USER_DOC_CACHE") == "1",
+)
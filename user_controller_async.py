@@ -0,0 +1,538 @@
+# controllers/user/user_controller_async.py
+"""
+Modo de ejecución ASGI (opcional) de los controladores de usuario: mismas rutas y
+mismos contratos de respuesta que user_controller.py, sobre Starlette + Motor.
+
+    uvicorn controllers.user.user_controller_async:app --workers 2
+
+Configuración: MONGO_URI, MONGO_DB y, si difieren, USERS_COLLECTION / APPS_COLLECTION /
+ROLES_COLLECTION. Todas las lecturas y escrituras de usuarios (incluidas las membresías y los
+índices) van por AsyncUserStore, con esa única configuración.
+
+Diferencias con el modo WSGI:
+- las rutas masivas (bulk, export, stats, PATCH /user/batch) siguen solo en modo WSGI;
+- GET /user/<id> lee siempre de Mongo (sin la cache de documentos de models.user.cache);
+- Idempotency-Key usa el mismo store, pero las peticiones concurrentes esperan sondeándolo
+  (no hay evento compartido con el proceso WSGI).
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from controllers.user.user_controller import (
+    EnrollmentError, _parse_enrollment, _after_user_write,
+    ITEM_PROJECTION, LIST_MAX_LIMIT, _list_projection, _next_after, _without_app_secrets,
+)
+from models.user.indexes import ensure_indexes_once
+from models.user.writes import enroll_user_async
+from utils.auth_manager import generate_verification_code
+from models.user import memberships
+from utils import idempotency
+from utils.email_outbox import outbox
+from utils.name_resolver import app_names, role_names
+from utils.password_hashing import password_hasher, HashingSaturated
+from utils.password_validator import validate_password
+from utils.rate_limiter import client_ip, limiter
+from utils.response_encoding import dumps, public_document
+from utils.server_response import StatusCode
+
+from utils.message_codes import (
+    CREATED, USER_ALREADY_REGISTERED, UNEXPECTED_ERROR,
+    MISSING_REQUIRED_FIELDS, USER_NOT_FOUND, USER_NOT_ACTIVE,
+    INVALID_OLD_PASSWORD, PASSWORDS_DO_NOT_MATCH, PASSWORD_UPDATED_SUCCESSFULLY,
+    UNEXPECTED_ERROR_OCCURRED, PASSWORD_RESET_INITIATED, UPDATE_USER_FAILED,
+    INVALID_VERIFICATION_CODE, VERIFICATION_EXPIRED, VERIFICATION_SUCCESSFUL
+)
+
+
+class AsyncUserStore:
+    # capa de datos async equivalente a UserModel / __dbmanager__
+
+    def __init__(self, uri=None, db_name=None):
+        self.client = AsyncIOMotorClient(uri or os.getenv("MONGO_URI", "mongodb://localhost:27017"))
+        db = self.client[db_name or os.getenv("MONGO_DB", "security_service")]
+        self.users = db[os.getenv("USERS_COLLECTION", "users")]
+        self.apps = db[os.getenv("APPS_COLLECTION", "apps")]
+        self.roles = db[os.getenv("ROLES_COLLECTION", "roles")]
+
+    async def after_user_write(self, query):
+        # mismos hooks que _after_user_write, con las membresías sincronizadas por esta conexión
+        _after_user_write(query, resync=False)
+        await memberships.sync_users_async(self.users, query)
+
+    async def update_password(self, email, password):
+        # equivalente a UserModel.update_password
+        return await self.users.update_one({"email": email}, {"$set": {"password": password}})
+
+    async def update_reset_password_info(self, email, code, expiration, password):
+        # equivalente a UserModel.update_reset_password_info
+        result = await self.users.update_one(
+            {"email": email},
+            {"$set": {"verification_code": code, "code_expliration": expiration, "password": password}}
+        )
+        return result.matched_count > 0
+
+    async def find_by_email(self, email, projection=None):
+        return await self.users.find_one({"email": email}, projection)
+
+    async def get_by_id(self, id, projection=None):
+        return await self.users.find_one({"_id": ObjectId(id)}, projection)
+
+    async def resolve_names(self, pairs):
+        # pairs: [(role, app)]; llenan la cache compartida de name_resolver. Primero las apps y
+        # después los roles de cada app en paralelo (los nombres de rol se repiten entre apps)
+        apps = await app_names.resolve_many_async(self.apps, [a for _, a in pairs if a and not ObjectId.is_valid(a)])
+        roles_by_app = {}
+        for role, app in pairs:
+            app_oid = ObjectId(app) if app and ObjectId.is_valid(app) else apps.get(app)
+            if app_oid and role and not ObjectId.is_valid(role):
+                roles_by_app.setdefault(app_oid, []).append(role)
+        await asyncio.gather(*(
+            role_names.resolve_many_async(self.roles, roles, app_oid) for app_oid, roles in roles_by_app.items()
+        ))
+
+
+store = AsyncUserStore()
+
+
+async def _resolve_oid(value, resolver, collection, scope=None):
+    # acepta ObjectId en texto o nombre (resuelto vía cache compartida; los roles, dentro de la app `scope`)
+    if ObjectId.is_valid(value):
+        return ObjectId(value)
+    return (await resolver.resolve_many_async(collection, [value], scope)).get(value)
+
+
+def _response(message=None, message_code=None, data=None, status=StatusCode.OK, headers=None):
+    # mismo sobre que ServerResponse (message, message_code, data)
+    body = {"message": message, "message_code": message_code, "data": data}
+    return Response(dumps(body), status_code=int(getattr(status, "value", status)),
+                    media_type="application/json", headers=headers)
+
+
+async def _next_or_none(rows):
+    try:
+        return await rows.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _json(request):
+    try:
+        data = await request.json()
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _rate_limited(request, rule, email):
+    keys = {"ip": client_ip(request.client.host if request.client else "", request.headers.get("x-forwarded-for", ""))}
+    if isinstance(email, str):
+        keys["email"] = email.strip().lower()
+    wait = limiter.check(rule, keys)
+    if wait:
+        return _response(message="Too many requests, try again later.", status=HTTPStatus.TOO_MANY_REQUESTS,
+                         headers={"Retry-After": str(max(1, int(wait + 0.999)))})
+    return None
+
+
+async def _with_idempotency(request, scope, handler):
+    """
+    Mismo contrato que utils.idempotency.idempotent: replay con una búsqueda, 409 si la clave
+    se reusa con otro body, y las concurrentes esperan a la primera (sondeando el store).
+    """
+    header = request.headers.get("Idempotency-Key")
+    if not header:
+        return await handler()
+
+    key, fingerprint = idempotency.request_key(scope, header, await request.body())
+    state, value = await run_in_threadpool(idempotency.check, key, fingerprint)
+    if state != idempotency.DONE and state != idempotency.CONFLICT:
+        if not await run_in_threadpool(idempotency.claim, key, fingerprint):
+            deadline = time.monotonic() + idempotency.IDEMPOTENCY_WAIT
+            while True:
+                if time.monotonic() > deadline:
+                    return _response(message=idempotency.IN_PROGRESS, status=StatusCode.CONFLICT)
+                await asyncio.sleep(0.05)
+                state, value = await run_in_threadpool(idempotency.check, key, fingerprint)
+                if state in (idempotency.DONE, idempotency.CONFLICT):
+                    break
+                # la petición original falló y liberó la clave: se ejecuta esta
+                if state is None and await run_in_threadpool(idempotency.claim, key, fingerprint):
+                    break
+
+    if state == idempotency.CONFLICT:
+        return _response(message=value, status=StatusCode.CONFLICT)
+    if state == idempotency.DONE:
+        return Response(value["body"], status_code=value["status"],
+                        headers={"Content-Type": value["content_type"], "Idempotent-Replayed": "true"})
+
+    try:
+        response = await handler()
+    except BaseException:
+        await run_in_threadpool(idempotency.release, key)
+        raise
+    if isinstance(response, StreamingResponse):
+        await run_in_threadpool(idempotency.release, key)
+    else:
+        await run_in_threadpool(idempotency.complete, key, fingerprint, response.status_code,
+                                response.body, response.headers.get("content-type"))
+    return response
+
+
+def _unexpected(route, e, message_code=UNEXPECTED_ERROR):
+    logging.error(f"[{route}] {str(e)}", exc_info=True)
+    return _response(message="An unexpected error occurred.", message_code=message_code,
+                     status=StatusCode.INTERNAL_SERVER_ERROR)
+
+
+# =========================================
+# POST /user/enrollment
+# =========================================
+async def enrollment(request):
+    return await _with_idempotency(request, "enrollment", lambda: _enroll(request))
+
+
+async def _enroll(request):
+    try:
+        data = await _json(request)
+        apps_body = data.get("apps") or []
+        await store.resolve_names(
+            [(data.get("role_name"), data.get("app_name"))]
+            + [(ap.get("role"), ap.get("app")) for ap in apps_body if isinstance(ap, dict)]
+        )
+
+        try:
+            # con la cache ya llena no hay consultas; los nombres inexistentes se resuelven fuera del loop
+            name, email, password, apps_to_assign = await run_in_threadpool(_parse_enrollment, data)
+        except EnrollmentError as err:
+            return _response(message=err.message, message_code=err.message_code, status=err.status)
+
+        email = email.strip()
+        # mismo camino que el modo WSGI; index_ready("email_unique") decide si el insert puede
+        # apoyarse en el índice único (delegate es la colección pymongo de este mismo cliente Motor)
+        await run_in_threadpool(ensure_indexes_once, store.users.delegate)
+        created, dup = await enroll_user_async(store.users, name.strip(), email, password, apps_to_assign,
+                                               password_hasher.encrypt_async)
+        if dup is not None:
+            return _response(message=f"User already assigned to role '{dup['role']}' and app '{dup['app']}'.",
+                             message_code=USER_ALREADY_REGISTERED, status=StatusCode.CONFLICT)
+
+        await store.after_user_write({"email": email})
+        outbox.enqueue_codes(email, [ap["code"] for ap in apps_to_assign])
+        if not created:
+            return _response(message="User updated with new role(s) and app(s). Verification code(s) sent.",
+                             message_code=CREATED, status=StatusCode.OK)
+        return _response(message="User created successfully and verification code(s) sent.",
+                         message_code=CREATED, status=StatusCode.CREATED)
+
+    except HashingSaturated:
+        return _response(message="Password service is busy, try again later.", status=HTTPStatus.SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return _unexpected("POST /user/enrollment", e)
+
+
+# =========================================
+# GET /user?app_id=
+# =========================================
+async def users_list(request):
+    try:
+        args = request.query_params
+        query = {}
+        app_oid = None
+        status = args.get("status")
+        session = args.get("is_session_active")
+        session = None if session is None else session.lower() == "true"
+        app_id = args.get("app_id")
+        if app_id:
+            app_oid = await _resolve_oid(app_id, app_names, store.apps)
+            if not app_oid:
+                return _response(message="Application not found", status=StatusCode.NOT_FOUND)
+            elem = {"app": app_oid}
+            if status is not None:
+                elem["status"] = status
+            if session is not None:
+                elem["is_session_active"] = session
+            query = {"apps": {"$elemMatch": elem}}
+
+        limit = args.get("limit")
+        if limit is not None:
+            limit = int(limit) if limit.isdigit() else 0
+            if limit < 1 or limit > LIST_MAX_LIMIT:
+                return _response(message=f"'limit' must be an integer between 1 and {LIST_MAX_LIMIT}",
+                                 status=StatusCode.BAD_REQUEST)
+
+        after = args.get("after")
+        if after:
+            if not ObjectId.is_valid(after):
+                return _response(message="'after' must be a valid user id", status=StatusCode.BAD_REQUEST)
+            after = ObjectId(after)
+            query["_id"] = {"$gt": after}
+
+        projection = _list_projection(args.get("fields"))
+
+        page_ids = None
+        if app_oid and memberships.enabled():
+            page_ids, cursor = await _users_via_memberships(app_oid, after or None, limit, projection, status, session)
+        else:
+            cursor = store.users.find(query, projection).sort("_id", 1)
+            if limit:
+                cursor = cursor.limit(limit)
+
+        # primer lote antes de responder: los errores de consulta siguen siendo un 500
+        rows = cursor.__aiter__()
+        first = await _next_or_none(rows)
+
+        async def stream():
+            yield b'{"data":['
+            count, last_id = 0, None
+            try:
+                d = first
+                while d is not None:
+                    last_id = d["_id"]
+                    yield (b"," if count else b"") + dumps(public_document(d))
+                    count += 1
+                    d = await _next_or_none(rows)
+            except Exception as e:
+                # se corta la respuesta en vez de cerrar un JSON que parezca completo
+                logging.error(f"[GET /user] stream aborted: {str(e)}", exc_info=True)
+                raise
+            yield b'],"next_after":' + dumps(_next_after(limit, count, last_id, page_ids)) + b'}'
+
+        return StreamingResponse(stream(), media_type="application/json")
+
+    except Exception as e:
+        return _unexpected("GET /user", e)
+
+
+async def _users_via_memberships(app_oid, after, limit, projection, status, session):
+    # modo user_app_memberships: ids por índice cubierto (pymongo, fuera del loop) y usuarios por lotes de $in;
+    # devuelve (ids, usuarios) como la versión WSGI
+    ids = await memberships.user_ids_for_app_async(store.users, app_oid, after, limit, status, session)
+
+    async def _users():
+        for start in range(0, len(ids), 500):
+            async for doc in store.users.find({"_id": {"$in": ids[start:start + 500]}}, projection).sort("_id", 1):
+                yield doc
+
+    return ids, _users()
+
+
+# =========================================
+# GET|PATCH|DELETE /user/<id>
+# =========================================
+async def user_item(request):
+    id = request.path_params["id"]
+    try:
+        if request.method == "GET":
+            doc = await store.get_by_id(id, ITEM_PROJECTION)
+            if not doc:
+                return _response(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND)
+            return _response(data=public_document(doc))
+
+        if request.method == "PATCH":
+            return await _patch_item(request, id)
+
+        updated = await store.users.find_one_and_update(
+            {"_id": ObjectId(id), "apps": {"$type": "array"}},
+            {"$set": {"apps.$[].status": "inactive", "apps.$[].is_session_active": False}},
+            projection=ITEM_PROJECTION,
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated:
+            updated = await store.get_by_id(id, ITEM_PROJECTION)
+            if not updated:
+                return _response(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND)
+        await store.after_user_write({"_id": updated["_id"]})
+        return _response(message="All accesses inactivated", data=public_document(updated))
+
+    except Exception as e:
+        return _unexpected(f"{request.method} /user/{id}", e)
+
+
+async def _patch_item(request, id):
+    data = await _json(request)
+    app_in = data.get("app_id")
+    if not app_in:
+        return _response(message="Field 'app_id' is required to update app fields (status, role, is_session_active).",
+                         status=StatusCode.BAD_REQUEST)
+
+    role_in = data.get("role")
+    # el rol se resuelve dentro de la app (los nombres de rol se repiten entre apps)
+    app_oid = await _resolve_oid(app_in, app_names, store.apps)
+    if not app_oid:
+        return _response(message="Application not found", status=StatusCode.NOT_FOUND)
+    role_oid = await _resolve_oid(role_in, role_names, store.roles, app_oid) if role_in else None
+
+    updates = {}
+    if "status" in data:
+        updates["apps.$.status"] = data["status"]
+    if role_in:
+        if not role_oid:
+            return _response(message="Invalid role", status=StatusCode.UNPROCESSABLE_ENTITY)
+        updates["apps.$.role"] = role_oid
+    if "is_session_active" in data:
+        updates["apps.$.is_session_active"] = bool(data["is_session_active"])
+    if not updates:
+        return _response(message="No changes provided", status=StatusCode.BAD_REQUEST)
+
+    projection = {"apps.$": 1} if request.query_params.get("return") == "app" else ITEM_PROJECTION
+    doc = await store.users.find_one_and_update(
+        {"_id": ObjectId(id), "apps.app": app_oid},
+        {"$set": updates},
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc:
+        return _response(message="User or app assignment not found", status=StatusCode.NOT_FOUND)
+    await store.after_user_write({"_id": doc["_id"]})
+    return _response(message="User app updated", data=public_document(_without_app_secrets(doc)))
+
+
+# =========================================
+#  /user/password  (PUT | POST)
+# =========================================
+async def user_password(request):
+    data = await _json(request)
+    try:
+        if request.method == "PUT":
+            return await _change_password(request, data)
+        return await _reset_password(request, data)
+    except HashingSaturated:
+        return _response(message="Password service is busy, try again later.", status=HTTPStatus.SERVICE_UNAVAILABLE)
+    except Exception as e:
+        return _unexpected(f"{request.method} /user/password", e, UNEXPECTED_ERROR_OCCURRED)
+
+
+async def _change_password(request, data):
+    limited = _rate_limited(request, "password_change", data.get("user_email"))
+    if limited:
+        return limited
+
+    user_email = data.get("user_email")
+    old_password = data.get("old_password")
+    new_password = data.get("new_password")
+    confirm_password = data.get("confirm_password")
+
+    if not all([user_email, old_password, new_password, confirm_password]):
+        return _response(message="All fields are required: user_email, old_password, new_password, confirm_password",
+                         message_code=MISSING_REQUIRED_FIELDS, status=StatusCode.BAD_REQUEST)
+
+    user = await store.find_by_email(user_email, {"password": 1, "apps.status": 1})
+    if not user:
+        return _response(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND)
+    if not any((a.get("status") == "Active") for a in (user.get("apps") or [])):
+        return _response(message="User is not active", message_code=USER_NOT_ACTIVE, status=StatusCode.FORBIDDEN)
+    if not await password_hasher.verify_async(old_password, user["password"]):
+        return _response(message="Old password is incorrect", message_code=INVALID_OLD_PASSWORD, status=StatusCode.UNAUTHORIZED)
+
+    msg = validate_password(new_password)
+    if msg:
+        return _response(message=msg, status=StatusCode.BAD_REQUEST)
+    if new_password != confirm_password:
+        return _response(message="New password and confirm password do not match",
+                         message_code=PASSWORDS_DO_NOT_MATCH, status=StatusCode.BAD_REQUEST)
+
+    encrypted_password = await password_hasher.encrypt_async(new_password)
+    await store.update_password(user_email, encrypted_password)
+    return _response(message="Password updated successfully", message_code=PASSWORD_UPDATED_SUCCESSFULLY)
+
+
+async def _reset_password(request, data):
+    # el replay de una clave ya completada no pasa por el limitador (mismo orden que en WSGI)
+    async def _limited_reset():
+        return _rate_limited(request, "password_reset", data.get("email")) or await _start_reset(data)
+    return await _with_idempotency(request, "password_reset", _limited_reset)
+
+
+async def _start_reset(data):
+    user_email = data.get("email")
+    if not user_email:
+        return _response(message="User email is required", message_code=MISSING_REQUIRED_FIELDS, status=StatusCode.BAD_REQUEST)
+
+    if not await store.find_by_email(user_email, {"_id": 1}):
+        return _response(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND)
+
+    verification_code = generate_verification_code()
+    expiration_time = datetime.utcnow() + timedelta(minutes=5)
+    temporal_password = f"{user_email.split('@')[0]}{verification_code}"
+
+    encrypted_temp_password = await password_hasher.encrypt_async(temporal_password)
+    updated = await store.update_reset_password_info(user_email, verification_code, expiration_time,
+                                                     encrypted_temp_password)
+    if updated:
+        outbox.enqueue_new_password(user_email, temporal_password)
+        return _response(message="Password reset initiated", message_code=PASSWORD_RESET_INITIATED)
+    return _response(message="Failed to update user information", message_code=UPDATE_USER_FAILED,
+                     status=StatusCode.INTERNAL_SERVER_ERROR)
+
+
+# =========================================
+#  /user/verification  (PUT)
+# =========================================
+async def user_verification(request):
+    if request.method == "OPTIONS":
+        return Response(headers={
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Headers": "Content-Type,Authorization",
+            "Access-Control-Allow-Methods": "GET,PUT,POST,DELETE,OPTIONS",
+        })
+    try:
+        data = await _json(request)
+        limited = _rate_limited(request, "verification", data.get("user_email"))
+        if limited:
+            return limited
+
+        email = data.get("user_email")
+        code = str(data.get("verification_code") or "")
+        if not code:
+            return _response(message="Invalid verification code", message_code=INVALID_VERIFICATION_CODE, status=StatusCode.UNAUTHORIZED)
+
+        codes = [code, int(code)] if code.isdigit() else [code]
+        now = datetime.utcnow()
+        not_expired = [
+            {"code_expliration": {"$gt": now}},
+            {"code_expliration": {"$gt": now.strftime("%Y/%m/%d %H:%M:%S")}},
+            # sin expiración (ausente, vacía, o ilegible y migrada a None): como antes, no vence
+            {"code_expliration": {"$in": [None, ""]}},
+        ]
+        updated = await store.users.find_one_and_update(
+            {"email": email, "apps": {"$elemMatch": {"code": {"$in": codes}, "$or": not_expired}}},
+            {"$set": {"apps.$.status": "Active", "apps.$.code": "", "apps.$.code_expliration": None}},
+            projection={"_id": 1}
+        )
+        if not updated:
+            user = await store.users.find_one({"email": email}, {"apps": {"$elemMatch": {"code": {"$in": codes}}}})
+            if not user:
+                return _response(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND)
+            if not user.get("apps"):
+                return _response(message="Invalid verification code", message_code=INVALID_VERIFICATION_CODE, status=StatusCode.UNAUTHORIZED)
+            return _response(message="Verification code expired", message_code=VERIFICATION_EXPIRED, status=StatusCode.UNAUTHORIZED)
+
+        await store.after_user_write({"_id": updated["_id"]})
+        return _response(message="User successfully verified", message_code=VERIFICATION_SUCCESSFUL)
+
+    except Exception as e:
+        logging.error(f"[PUT /user/verification] {str(e)}", exc_info=True)
+        return _response(message="An unexpected error occurred.", status=StatusCode.INTERNAL_SERVER_ERROR)
+
+
+routes = [
+    Route("/user/enrollment", enrollment, methods=["POST"]),
+    Route("/user/password", user_password, methods=["PUT", "POST"]),
+    Route("/user/verification", user_verification, methods=["PUT", "OPTIONS"]),
+    Route("/user", users_list, methods=["GET"]),
+    Route("/user/{id}", user_item, methods=["GET", "PATCH", "DELETE"]),
+]
+
+app = Starlette(routes=routes)
@@ -1,22 +1,44 @@
 # controllers/user/user_controller.py
+import csv
+import io
+import json
 import logging
+import os
 import random
+import threading
+import time
+import zlib
+from collections import Counter
 from datetime import datetime, timedelta
+from http import HTTPStatus
 from bson import ObjectId
-from flask import request, make_response
+from flask import request, make_response, Response, stream_with_context
 from flask_restful import Resource
+from pymongo import InsertOne, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from validate_email import validate_email
 
 from models.user.user import UserModel
-from models.role.role import RoleModel
 from models.user.db_queries import __dbmanager__
-from models.apps.db_queries import get_by_name as get_app_by_name
+from models.user.indexes import ensure_indexes_once
+from models.user import memberships
+from models.user.cache import user_cache
+from models.user.writes import change_role_for_app, duplicate_assignment, enroll_user, enrollment_guard
 
-from utils.email_manager import send_email, send_email_new_password
+from utils.name_resolver import app_names, role_names
+
+from utils.email_outbox import outbox
 from utils.server_response import ServerResponse, StatusCode
+from utils.response_encoding import dumps, json_response, public_document
 from utils.auth_manager import generate_verification_code
-from utils.encryption_utils import EncryptionUtil
+from utils.code_expiry import start_sweeper_once
+from utils.password_hashing import password_hasher, bulk_password_hasher, HashingSaturated
 from utils.password_validator import validate_password
+from utils.rate_limiter import rate_limited
+from utils.idempotency import idempotent
+
+from utils.request_metrics import instrument, register_gauges
+from utils.name_resolver import name_cache_stats
 
 from utils.message_codes import (
     CREATED, INVALID_EMAIL_DOMAIN, INVALID_NAME, INVALID_PASSWORD,
@@ -27,197 +49,473 @@ from utils.message_codes import (
     INVALID_VERIFICATION_CODE, VERIFICATION_EXPIRED, VERIFICATION_SUCCESSFUL
 )
 
+# -------- Instrumentación del hot path (Server-Timing, logs, /metrics) --------
+__dbmanager__ = instrument(__dbmanager__, "db", nested=("collection",))
+UserModel = instrument(UserModel, "user_model")
+outbox = instrument(outbox, "email")
+password_hasher = instrument(password_hasher, "password_hash")
+bulk_password_hasher = instrument(bulk_password_hasher, "password_hash_bulk")
+app_names = instrument(app_names, "app_names")
+role_names = instrument(role_names, "role_names")
+register_gauges(lambda: {
+    f'name_cache_{metric}{{collection="{coll}"}}': value
+    for coll, stats in name_cache_stats().items()
+    for metric, value in stats.items()
+})
+register_gauges(lambda: {f"user_doc_cache_{metric}": value for metric, value in user_cache.stats().items()})
+
+# Paginación de GET /user
+LIST_MAX_LIMIT = 1000
+# Campos que nunca se devuelven (listados, /user/<id> y la cache de documentos)
+LIST_SENSITIVE_FIELDS = ("password", "apps.code", "apps.token")
+# Subcampos que se devuelven cuando se pide fields=apps
+LIST_APP_FIELDS = ("apps.app", "apps.role", "apps.status", "apps.is_session_active")
+# Proyección de las respuestas de PATCH/DELETE /user/<id> (mismo cuerpo que GET y que el modo ASGI)
+ITEM_PROJECTION = {f: 0 for f in LIST_SENSITIVE_FIELDS}
+# Registros por lote en enrollment masivo (una consulta $in + un bulk_write por lote)
+BULK_CHUNK_SIZE = 1000
+# Máximo de ids por llamada a PATCH /user/batch (para más, usar "filter")
+BATCH_MAX_USER_IDS = 10000
+# Vida de los resultados cacheados de GET /user/stats (segundos)
+STATS_CACHE_TTL = float(os.getenv("USER_STATS_CACHE_TTL", "30"))
+
+# Exportación: filas por lote del cursor (y por escritura al stream)
+EXPORT_DEFAULT_BATCH_SIZE = 1000
+EXPORT_MAX_BATCH_SIZE = 10000
+EXPORT_COLUMNS = ("user_id", "name", "email", "app", "role", "status", "is_session_active")
+
+_stats_cache = {}   # app_id|None -> (expires_at, data)
+_stats_lock = threading.Lock()
+
+
+def _users_collection():
+    # colección pymongo que envuelve __dbmanager__; en el primer uso asegura los índices
+    # y arranca el barrido de códigos vencidos
+    collection = __dbmanager__.collection
+    ensure_indexes_once(collection)
+    start_sweeper_once(collection)
+    return collection
+
+
+def _after_user_write(query, resync=True):
+    # hooks comunes tras escribir usuarios: membresías (si está activo), cache de documentos
+    # y cache de estadísticas; resync=False cuando el llamador ya actualizó las membresías
+    user_cache.invalidate(query)
+    if resync:
+        memberships.sync_users(_users_collection(), query)
+    with _stats_lock:
+        _stats_cache.clear()
+
+
+def _users_via_memberships(collection, app_oid, after, limit, projection, status=None, is_session_active=None):
+    """
+    Modo user_app_memberships: ids por índice cubierto y luego los usuarios por lotes de $in.
+    Devuelve (ids, usuarios): next_after sale del último id de membresía, no de los usuarios
+    encontrados, para que una membresía huérfana no corte la paginación.
+    """
+    ids = list(memberships.user_ids_for_app(collection, app_oid, after, limit, status, is_session_active))
+
+    def _users():
+        for start in range(0, len(ids), 500):
+            yield from collection.find({"_id": {"$in": ids[start:start + 500]}}, projection).sort("_id", 1)
+
+    return ids, _users()
+
+
+def _next_after(limit, count, last_id, page_ids=None):
+    # con membresías, la página está completa si se leyeron `limit` membresías
+    if page_ids is not None:
+        count, last_id = len(page_ids), (page_ids[-1] if page_ids else None)
+    return str(last_id) if limit and count == limit else None
+
+
+def _list_projection(raw_fields):
+    # fields=name,email,apps.status; "apps" se expande a los subcampos no sensibles
+    fields = []
+    for f in (f.strip() for f in (raw_fields or "").split(",")):
+        if f == "apps":
+            fields.extend(LIST_APP_FIELDS)
+        elif f and f != "_id" and not f.startswith(LIST_SENSITIVE_FIELDS):
+            fields.append(f)
+    if fields:
+        return {f: 1 for f in fields}
+    return {f: 0 for f in LIST_SENSITIVE_FIELDS}
+
+
+def _without_app_secrets(doc):
+    # {"apps.$": 1} es una proyección de inclusión: code/token del elemento se quitan aquí
+    doc["apps"] = [
+        {k: v for k, v in app.items() if f"apps.{k}" not in LIST_SENSITIVE_FIELDS}
+        for app in doc.get("apps") or []
+    ]
+    return doc
+
+
+def _to_oid(value, resolver, scope=None):
+    # acepta ObjectId en texto o nombre (resuelto vía cache; los roles, dentro de la app `scope`)
+    try:
+        return ObjectId(value)
+    except Exception:
+        return resolver.resolve(value, scope)
+
+
+class EnrollmentError(Exception):
+    # error de validación de un registro de enrollment (individual o bulk)
+
+    def __init__(self, message, status, message_code=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.message_code = message_code
+
+    def to_response(self):
+        if self.message_code:
+            return ServerResponse(message=self.message, message_code=self.message_code, status=self.status).to_response()
+        return ServerResponse(message=self.message, status=self.status).to_response()
+
+
+def _new_app_assignment(role_oid, app_oid, code):
+    return {
+        "role": role_oid,
+        "app":  app_oid,
+        "code": code,
+        "token": "",
+        "status": "Pending",
+        "code_expliration": datetime.utcnow() + timedelta(minutes=5),
+        "is_session_active": False
+    }
+
+
+def _parse_enrollment(data):
+    """
+    Valida un body de enrollment y construye apps_to_assign.
+    Devuelve (name, email, password, apps_to_assign); lanza EnrollmentError.
+    """
+    name = data.get('name')
+    email = data.get('email')
+    password = data.get('password')
+
+    # modo simple
+    role_name = data.get('role_name')
+    app_name  = data.get('app_name')
+
+    # modo arreglo (compatibilidad)
+    apps_body = data.get('apps', [])
+
+    # -------- Validaciones base --------
+    if not name or len(name.strip()) < 2:
+        raise EnrollmentError("The name does not meet the established standards",
+                              StatusCode.UNPROCESSABLE_ENTITY, INVALID_NAME)
+
+    if not email or not validate_email(email):
+        raise EnrollmentError("The provided email is not valid",
+                              StatusCode.UNPROCESSABLE_ENTITY, INVALID_EMAIL_DOMAIN)
+
+    if not password or len(password) < 8:
+        raise EnrollmentError("The password does not meet the established standards",
+                              StatusCode.UNPROCESSABLE_ENTITY, INVALID_PASSWORD)
+
+    policy_msg = validate_password(password)
+    if policy_msg:
+        raise EnrollmentError(policy_msg, StatusCode.BAD_REQUEST)
+
+    # -------- Construcción de apps_to_assign --------
+    apps_to_assign = []
+
+    # 1) role_name + app_name
+    if role_name or app_name:
+        if not role_name or not app_name:
+            raise EnrollmentError("Both 'role_name' and 'app_name' are required", StatusCode.BAD_REQUEST)
+
+        app_oid = app_names.resolve(app_name)
+        if not app_oid:
+            raise EnrollmentError(f"Application not found: {app_name}", StatusCode.NOT_FOUND)
+
+        role_oid = role_names.resolve(role_name, app_oid)
+        if not role_oid:
+            raise EnrollmentError(f"Invalid role: {role_name}", StatusCode.UNPROCESSABLE_ENTITY)
+
+        apps_to_assign.append(_new_app_assignment(role_oid, app_oid, generate_verification_code()))
+
+    # 2) arreglo apps[] 
+    # precarga de nombres: una consulta $in para las apps y otra de roles por app
+    app_names.resolve_many([ap.get("app") for ap in apps_body or [] if not ObjectId.is_valid(ap.get("app") or "")])
+    roles_by_app = {}
+    for ap in apps_body or []:
+        app_oid = _to_oid(ap.get("app"), app_names) if ap.get("app") else None
+        if app_oid and not ObjectId.is_valid(ap.get("role") or ""):
+            roles_by_app.setdefault(app_oid, []).append(ap.get("role"))
+    for app_oid, roles in roles_by_app.items():
+        role_names.resolve_many(roles, app_oid)
+
+    for ap in apps_body or []:
+        role_val = ap.get("role")
+        app_val  = ap.get("app")
+        if not role_val or not app_val:
+            raise EnrollmentError("Each app item must include 'role' and 'app'", StatusCode.UNPROCESSABLE_ENTITY)
+
+        app_oid = _to_oid(app_val, app_names)
+        if not app_oid:
+            raise EnrollmentError(f"Application not found: {app_val}", StatusCode.NOT_FOUND)
+
+        role_oid = _to_oid(role_val, role_names, app_oid)
+        if not role_oid:
+            raise EnrollmentError(f"Invalid role: {role_val}", StatusCode.UNPROCESSABLE_ENTITY)
+
+        apps_to_assign.append(_new_app_assignment(role_oid, app_oid, str(random.randint(100000, 999999))))
+
+    if not apps_to_assign:
+        raise EnrollmentError("At least one role/app assignment is required.", StatusCode.BAD_REQUEST)
+
+    return name, email, password, apps_to_assign
+
+
 # =========================================
 # POST /user/enrollment
 # =========================================
 class UserEnrollmentController(Resource):
     route = '/user/enrollment'
 
+    @idempotent("enrollment")
     def post(self):
         try:
             data = request.get_json(force=True, silent=True) or {}
 
-            name = data.get('name')
-            email = data.get('email')
-            password = data.get('password')
-
-            # modo simple
-            role_name = data.get('role_name')
-            app_name  = data.get('app_name')
-
-            # modo arreglo (compatibilidad)
-            apps_body = data.get('apps', [])
+            try:
+                name, email, password, apps_to_assign = _parse_enrollment(data)
+            except EnrollmentError as err:
+                return err.to_response()
 
-            # -------- Validaciones base --------
-            if not name or len(name.strip()) < 2:
+            # -------- Lógica principal  --------
+            email = email.strip()
+            # el duplicado se detecta antes de cifrar: solo un alta real usa el pool de hashing
+            created, dup = enroll_user(_users_collection(), name.strip(), email, password, apps_to_assign,
+                                       password_hasher.encrypt)
+            if dup is not None:
                 return ServerResponse(
-                    message="The name does not meet the established standards",
-                    message_code=INVALID_NAME,
-                    status=StatusCode.UNPROCESSABLE_ENTITY
+                    message=f"User already assigned to role '{dup['role']}' and app '{dup['app']}'.",
+                    message_code=USER_ALREADY_REGISTERED,
+                    status=StatusCode.CONFLICT
                 ).to_response()
 
-            if not email or not validate_email(email):
-                return ServerResponse(
-                    message="The provided email is not valid",
-                    message_code=INVALID_EMAIL_DOMAIN,
-                    status=StatusCode.UNPROCESSABLE_ENTITY
-                ).to_response()
+            _after_user_write({"email": email})
+            outbox.enqueue_codes(email, [ap["code"] for ap in apps_to_assign])
 
-            if not password or len(password) < 8:
+            if not created:
                 return ServerResponse(
-                    message="The password does not meet the established standards",
-                    message_code=INVALID_PASSWORD,
-                    status=StatusCode.UNPROCESSABLE_ENTITY
+                    message="User updated with new role(s) and app(s). Verification code(s) sent.",
+                    message_code=CREATED,
+                    status=StatusCode.OK
                 ).to_response()
 
-            policy_msg = validate_password(password)
-            if policy_msg:
-                return ServerResponse(message=policy_msg, status=StatusCode.BAD_REQUEST).to_response()
+            return ServerResponse(
+                message="User created successfully and verification code(s) sent.",
+                message_code=CREATED,
+                status=StatusCode.CREATED
+            ).to_response()
 
-            # -------- Construcción de apps_to_assign --------
-            apps_to_assign = []
+        except HashingSaturated:
+            return ServerResponse(message="Password service is busy, try again later.", status=HTTPStatus.SERVICE_UNAVAILABLE).to_response()
 
-            # 1) role_name + app_name
-            if role_name or app_name:
-                if not role_name or not app_name:
-                    return ServerResponse(
-                        message="Both 'role_name' and 'app_name' are required",
-                        status=StatusCode.BAD_REQUEST
-                    ).to_response()
-
-                role_doc = RoleModel.get_by_name(role_name)
-                # FIXED: Changed from role_doc.get("_id") to hasattr(role_doc, '_id')
-                if not role_doc or not hasattr(role_doc, '_id') or not role_doc._id:
-                    return ServerResponse(
-                        message=f"Invalid role: {role_name}",
-                        status=StatusCode.UNPROCESSABLE_ENTITY
-                    ).to_response()
-                role_oid = ObjectId(str(role_doc._id))
-
-                app_doc = get_app_by_name(app_name)
-                if not app_doc or not app_doc.get("_id"):
-                    return ServerResponse(
-                        message=f"Application not found: {app_name}",
-                        status=StatusCode.NOT_FOUND
-                    ).to_response()
-                app_oid = ObjectId(str(app_doc["_id"]))
-
-                apps_to_assign.append({
-                    "role": role_oid,
-                    "app":  app_oid,
-                    "code": generate_verification_code(),
-                    "token": "",
-                    "status": "Pending",
-                    "code_expliration": (datetime.utcnow() + timedelta(minutes=5)).strftime("%Y/%m/%d %H:%M:%S"),
-                    "is_session_active": False
-                })
-
-            # 2) arreglo apps[] 
-            for ap in apps_body or []:
-                role_val = ap.get("role")
-                app_val  = ap.get("app")
-                if not role_val or not app_val:
-                    return ServerResponse(
-                        message="Each app item must include 'role' and 'app'",
-                        status=StatusCode.UNPROCESSABLE_ENTITY
-                    ).to_response()
+        except Exception as e:
+            logging.error(f"[POST /user/enrollment] {str(e)}", exc_info=True)
+            return ServerResponse(
+                message="An unexpected error occurred.",
+                message_code=UNEXPECTED_ERROR,
+                status=StatusCode.INTERNAL_SERVER_ERROR
+            ).to_response()
 
-                try:
-                    role_oid = ObjectId(role_val)
-                except Exception:
-                    rdoc = RoleModel.get_by_name(role_val)
-                    # FIXED: Changed from rdoc.get("_id") to hasattr(rdoc, '_id')
-                    if not rdoc or not hasattr(rdoc, '_id') or not rdoc._id:
-                        return ServerResponse(
-                            message=f"Invalid role: {role_val}",
-                            status=StatusCode.UNPROCESSABLE_ENTITY
-                        ).to_response()
-                    role_oid = ObjectId(str(rdoc._id))
 
-                try:
-                    app_oid = ObjectId(app_val)
-                except Exception:
-                    adoc = get_app_by_name(app_val)
-                    if not adoc or not adoc.get("_id"):
-                        return ServerResponse(
-                            message=f"Application not found: {app_val}",
-                            status=StatusCode.NOT_FOUND
-                        ).to_response()
-                    app_oid = ObjectId(str(adoc["_id"]))
-
-                apps_to_assign.append({
-                    "role": role_oid,
-                    "app":  app_oid,
-                    "code": str(random.randint(100000, 999999)),
-                    "token": "",
-                    "status": "Pending",
-                    "code_expliration": (datetime.utcnow() + timedelta(minutes=5)).strftime("%Y/%m/%d %H:%M:%S"),
-                    "is_session_active": False
-                })
-
-            if not apps_to_assign:
-                return ServerResponse(
-                    message="At least one role/app assignment is required.",
-                    status=StatusCode.BAD_REQUEST
-                ).to_response()
+def iter_enrollment_records(lines, fmt="jsonl"):
+    """
+    Genera (line_no, record) desde JSONL o CSV (name,email,password,role_name,app_name).
+    Las líneas ilegibles se devuelven como (line_no, None).
+    """
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(lines), start=2):
+            yield line_no, {k.strip(): (v or "").strip() for k, v in row.items() if k}
+        return
+
+    for line_no, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+def bulk_enroll_records(records, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Enrollment masivo con las mismas validaciones que POST /user/enrollment.
+    Devuelve un reporte por registro: {"line", "email", "status", "message"}; status es
+    "created", "updated", "error" o "conflict" (un alta concurrente ya asignó el par).
+    """
+    results, chunk = [], []
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            results.extend(_bulk_enroll_chunk(chunk))
+            chunk = []
+    if chunk:
+        results.extend(_bulk_enroll_chunk(chunk))
+    return results
+
+
+def _record_email(record):
+    email = record.get("email")
+    return email if isinstance(email, str) else None
+
+
+def _unapplied_pushes(collection, pushes):
+    # {email: documento actual | None} de los $push que no quedaron escritos (guard sin coincidencia)
+    docs = {d["email"]: d for d in collection.find(
+        {"email": {"$in": list(pushes)}}, {"email": 1, "apps.role": 1, "apps.app": 1, "apps.code": 1})}
+    unapplied = {}
+    for email, t in pushes.items():
+        doc = docs.get(email)
+        present = {(str(a.get("role")), str(a.get("app")), a.get("code")) for a in (doc or {}).get("apps") or []}
+        if not all((str(a["role"]), str(a["app"]), a["code"]) in present for a in t["apps"]):
+            unapplied[email] = doc
+    return unapplied
+
+
+def _bulk_enroll_chunk(chunk):
+    results = {}
+    parsed = []
+    for line_no, record in chunk:
+        if record is None:
+            results[line_no] = {"line": line_no, "email": None, "status": "error", "message": "Malformed record"}
+            continue
+        try:
+            name, email, password, apps = _parse_enrollment(record)
+        except EnrollmentError as err:
+            results[line_no] = {"line": line_no, "email": _record_email(record), "status": "error", "message": err.message}
+            continue
+        except Exception as e:
+            # tipos inesperados (p. ej. "apps": "x" o "name": 5): error de esta línea, no del lote
+            results[line_no] = {"line": line_no, "email": _record_email(record), "status": "error",
+                                "message": f"Invalid record: {type(e).__name__}"}
+            continue
+        parsed.append((line_no, name.strip(), email.strip(), password, apps))
+
+    # -------- Usuarios existentes del lote: una sola consulta --------
+    collection = _users_collection()
+    assigned = {}
+    emails = list({p[2] for p in parsed})
+    if emails:
+        for doc in collection.find({"email": {"$in": emails}}, {"email": 1, "apps.role": 1, "apps.app": 1}):
+            assigned[doc["email"]] = {(str(a.get("role")), str(a.get("app"))) for a in doc.get("apps") or []}
+
+    # un InsertOne por usuario nuevo y un UpdateOne($push) por usuario existente
+    inserts, pushes = {}, {}
+    for line_no, name, email, password, apps in parsed:
+        pairs = assigned.get(email, set())
+        dup = next((a for a in apps if (str(a["role"]), str(a["app"])) in pairs), None)
+        if dup:
+            results[line_no] = {
+                "line": line_no, "email": email, "status": "error",
+                "message": f"User already assigned to role '{dup['role']}' and app '{dup['app']}'."
+            }
+            continue
+
+        if email in inserts:
+            target = inserts[email]
+        elif email in assigned:
+            target = pushes.setdefault(email, {"apps": [], "lines": []})
+        else:
+            target = inserts[email] = {"name": name, "password": password, "apps": [], "lines": []}
+        assigned.setdefault(email, set()).update((str(a["role"]), str(a["app"])) for a in apps)
+        target["apps"].extend(apps)
+        target["lines"].append(line_no)
+
+    # contraseñas de los usuarios nuevos: en tandas, en el pool de hashing masivo
+    try:
+        hashes = bulk_password_hasher.encrypt_many([t["password"] for t in inserts.values()])
+    except HashingSaturated:
+        for email, t in inserts.items():
+            for line_no in t["lines"]:
+                results[line_no] = {"line": line_no, "email": email, "status": "error",
+                                    "message": "Password service is busy, try again later."}
+        inserts, hashes = {}, []
+
+    ops, targets = [], []
+    for (email, t), hashed in zip(inserts.items(), hashes):
+        ops.append(InsertOne({
+            "name": t["name"],
+            "password": hashed,
+            "email": email,
+            "apps": t["apps"]
+        }))
+        targets.append((email, t, "created"))
+    for email, t in pushes.items():
+        # mismo guard que el enrollment individual: un alta concurrente entre la consulta de
+        # arriba y la escritura no puede dejar pares (role, app) repetidos
+        ops.append(UpdateOne(enrollment_guard(email, t["apps"]), {"$push": {"apps": {"$each": t["apps"]}}}))
+        targets.append((email, t, "updated"))
+
+    failed, matched = {}, len(pushes)
+    if ops:
+        try:
+            matched = collection.bulk_write(ops, ordered=False).matched_count
+        except BulkWriteError as bwe:
+            matched = bwe.details.get("nMatched", 0)
+            for err in bwe.details.get("writeErrors", []):
+                failed[err["index"]] = err.get("errmsg", "Write failed")
+
+    # bulk_write solo da el total de coincidencias: si faltan, se busca qué $push no se aplicó
+    attempted = [email for index, (email, _, status) in enumerate(targets) if status == "updated" and index not in failed]
+    conflicts = _unapplied_pushes(collection, {e: pushes[e] for e in attempted}) if matched < len(attempted) else {}
+
+    for index, (email, t, status) in enumerate(targets):
+        if index in failed:
+            for line_no in t["lines"]:
+                results[line_no] = {"line": line_no, "email": email, "status": "error", "message": failed[index]}
+            continue
+        if status == "updated" and email in conflicts:
+            dup = duplicate_assignment(conflicts[email], t["apps"])
+            message = (f"User already assigned to role '{dup['role']}' and app '{dup['app']}'." if dup
+                       else "User was modified concurrently, retry the record.")
+            for line_no in t["lines"]:
+                results[line_no] = {"line": line_no, "email": email, "status": "conflict", "message": message}
+            failed[index] = message
+            continue
+        for line_no in t["lines"]:
+            results[line_no] = {"line": line_no, "email": email, "status": status, "message": None}
+        outbox.enqueue_codes(email, [ap["code"] for ap in t["apps"]])
+
+    written = [email for index, (email, _, _) in enumerate(targets) if index not in failed]
+    if written:
+        _after_user_write({"email": {"$in": written}})
+
+    return [results[line_no] for line_no in sorted(results)]
 
-            # -------- Lógica principal  --------
-            existing_user = UserModel.find_by_email(email)
-            if existing_user:
-                user_apps = existing_user.get("apps", []) or []
-
-                for new_app in apps_to_assign:
-                    dup = any(
-                        str(ua.get("role")) == str(new_app["role"]) and
-                        str(ua.get("app"))  == str(new_app["app"])
-                        for ua in user_apps
-                    )
-                    if dup:
-                        return ServerResponse(
-                            message=f"User already assigned to role '{new_app['role']}' and app '{new_app['app']}'.",
-                            message_code=USER_ALREADY_REGISTERED,
-                            status=StatusCode.CONFLICT
-                        ).to_response()
-
-                user_apps.extend(apps_to_assign)
-                
-                UserModel.update_user(email, {"apps": user_apps})
-
-                for ap in apps_to_assign:
-                    try:
-                        send_email(email, ap["code"])
-                    except Exception as e:
-                        logging.warning(f"Email send failed to {email}: {e}")
 
-                return ServerResponse(
-                    message="User updated with new role(s) and app(s). Verification code(s) sent.",
-                    message_code=CREATED,
-                    status=StatusCode.OK
-                ).to_response()
+# =========================================
+# POST /user/enrollment/bulk  (JSONL | CSV)
+# =========================================
+class UserBulkEnrollmentController(Resource):
+    route = '/user/enrollment/bulk'
 
-            # crear usuario 
-            user_data = {
-                "name": name.strip(),
-                "password": password,
-                "email": email.strip(),
-                "apps": apps_to_assign
-            }
-            UserModel.create_user(user_data)
+    def post(self):
+        try:
+            content_type = request.content_type or ""
+            fmt = "csv" if "csv" in content_type or request.args.get("format") == "csv" else "jsonl"
+            lines = io.TextIOWrapper(request.stream, encoding="utf-8")
 
-            for ap in apps_to_assign:
-                try:
-                    send_email(email, ap["code"])
-                except Exception as e:
-                    logging.warning(f"Email send failed to {email}: {e}")
+            results = bulk_enroll_records(iter_enrollment_records(lines, fmt))
+            summary = Counter(r["status"] for r in results)
 
             return ServerResponse(
-                message="User created successfully and verification code(s) sent.",
-                message_code=CREATED,
-                status=StatusCode.CREATED
+                message="Bulk enrollment processed",
+                data={"summary": dict(summary, total=len(results)), "results": results},
+                status=StatusCode.OK
             ).to_response()
 
         except Exception as e:
-            logging.error(f"[POST /user/enrollment] {str(e)}", exc_info=True)
+            logging.error(f"[POST /user/enrollment/bulk] {str(e)}", exc_info=True)
             return ServerResponse(
                 message="An unexpected error occurred.",
                 message_code=UNEXPECTED_ERROR,
@@ -234,30 +532,73 @@ class UsersListController(Resource):
     def get(self):
         try:
             app_id = request.args.get('app_id')
+            status = request.args.get('status')
+            session = request.args.get('is_session_active')
+            session = None if session is None else session.lower() == "true"
             query = {}
+            app_oid = None
 
             if app_id:
+                app_oid = _to_oid(app_id, app_names)
+                if not app_oid:
+                    return ServerResponse(
+                        message="Application not found",
+                        status=StatusCode.NOT_FOUND
+                    ).to_response()
+
+                elem = {"app": app_oid}
+                if status is not None:
+                    elem["status"] = status
+                if session is not None:
+                    elem["is_session_active"] = session
+                query = {"apps": {"$elemMatch": elem}}
+
+            # -------- Paginación por cursor (_id) --------
+            limit = request.args.get('limit')
+            if limit is not None:
+                try:
+                    limit = int(limit)
+                except ValueError:
+                    limit = 0
+                if limit < 1 or limit > LIST_MAX_LIMIT:
+                    return ServerResponse(
+                        message=f"'limit' must be an integer between 1 and {LIST_MAX_LIMIT}",
+                        status=StatusCode.BAD_REQUEST
+                    ).to_response()
+
+            after = request.args.get('after')
+            if after:
                 try:
-                    app_oid = ObjectId(app_id)
+                    after = ObjectId(after)
+                    query["_id"] = {"$gt": after}
                 except Exception:
-                    adoc = get_app_by_name(app_id)
-                    if not adoc or not adoc.get("_id"):
-                        return ServerResponse(
-                            message="Application not found",
-                            status=StatusCode.NOT_FOUND
-                        ).to_response()
-                    app_oid = ObjectId(str(adoc["_id"]))
-
-                query = {"apps": {"$elemMatch": {"app": app_oid}}}
-
-            cursor = __dbmanager__.get_by_query(query)
-            data = []
-            for d in cursor or []:
-                d = dict(d)
-                d["id"] = str(d.pop("_id"))
-                data.append(d)
+                    return ServerResponse(
+                        message="'after' must be a valid user id",
+                        status=StatusCode.BAD_REQUEST
+                    ).to_response()
 
-            return ServerResponse(data=data, status=StatusCode.OK).to_response()
+            # -------- Proyección (fields=name,email,apps.status) --------
+            projection = _list_projection(request.args.get('fields'))
+
+            page_ids = None
+            if app_oid and memberships.enabled():
+                page_ids, cursor = _users_via_memberships(_users_collection(), app_oid, after or None, limit,
+                                                          projection, status, session)
+            else:
+                cursor = _users_collection().find(query, projection).sort("_id", 1)
+                if limit:
+                    cursor = cursor.limit(limit)
+
+            # el cursor es perezoso: el primer lote se pide aquí para que un error de consulta
+            # (proyección inválida, base caída) siga siendo un 500 y no una lista vacía
+            rows = iter(cursor)
+            first = next(rows, None)
+
+            return Response(
+                stream_with_context(self._stream(first, rows, limit, page_ids)),
+                status=200,
+                mimetype="application/json"
+            )
 
         except Exception as e:
             logging.error(f"[GET /user] {str(e)}", exc_info=True)
@@ -267,6 +608,335 @@ class UsersListController(Resource):
                 status=StatusCode.INTERNAL_SERVER_ERROR
             ).to_response()
 
+    @staticmethod
+    def _stream(first, rows, limit, page_ids=None):
+        """
+        Emite {"data": [...], "next_after": "<id>|null"} documento a documento,
+        sin materializar el resultado completo en memoria.
+        """
+        yield b'{"data":['
+        count = 0
+        last_id = None
+        try:
+            d = first
+            while d is not None:
+                last_id = d["_id"]
+                yield (b"," if count else b"") + dumps(public_document(d))
+                count += 1
+                d = next(rows, None)
+        except Exception as e:
+            # la respuesta ya comenzó: se corta la conexión en vez de cerrar un JSON válido,
+            # para que el cliente no lo confunda con el final de la lista
+            logging.error(f"[GET /user] stream aborted: {str(e)}", exc_info=True)
+            raise
+        yield b'],"next_after":' + dumps(_next_after(limit, count, last_id, page_ids)) + b'}'
+
+
+# =========================================
+# GET /user/stats?app_id=
+# =========================================
+class UserStatsController(Resource):
+    route = '/user/stats'
+
+    def get(self):
+        try:
+            app_id = request.args.get('app_id')
+            app_oid = None
+            if app_id:
+                app_oid = _to_oid(app_id, app_names)
+                if not app_oid:
+                    return ServerResponse(
+                        message="Application not found",
+                        status=StatusCode.NOT_FOUND
+                    ).to_response()
+
+            cache_key = str(app_oid) if app_oid else None
+            with _stats_lock:
+                cached = _stats_cache.get(cache_key)
+            if cached and cached[0] > time.monotonic():
+                return ServerResponse(data=cached[1], status=StatusCode.OK).to_response()
+
+            data = self._aggregate(app_oid)
+            with _stats_lock:
+                _stats_cache[cache_key] = (time.monotonic() + STATS_CACHE_TTL, data)
+            return ServerResponse(data=data, status=StatusCode.OK).to_response()
+
+        except Exception as e:
+            logging.error(f"[GET /user/stats] {str(e)}", exc_info=True)
+            return ServerResponse(
+                message="An unexpected error occurred.",
+                message_code=UNEXPECTED_ERROR,
+                status=StatusCode.INTERNAL_SERVER_ERROR
+            ).to_response()
+
+    @staticmethod
+    def _aggregate(app_oid):
+        """
+        Conteos por app, status y role en una sola agregación:
+        {"<app_id>": {"total", "active_sessions", "by_status": {...}, "by_role": {...}}}
+        En modo memberships, los conteos de una app salen de user_app_memberships.
+        """
+        if app_oid and memberships.enabled():
+            counts = memberships.counts_by_app(_users_collection(), app_oid)
+            return {str(app_oid): counts} if counts["total"] else {}
+
+        pipeline = []
+        if app_oid:
+            pipeline.append({"$match": {"apps.app": app_oid}})
+        pipeline += [
+            {"$project": {"_id": 0, "apps.app": 1, "apps.status": 1, "apps.role": 1, "apps.is_session_active": 1}},
+            {"$unwind": "$apps"},
+        ]
+        if app_oid:
+            pipeline.append({"$match": {"apps.app": app_oid}})
+        pipeline.append({"$group": {
+            "_id": {"app": "$apps.app", "status": "$apps.status", "role": "$apps.role"},
+            "total": {"$sum": 1},
+            "active_sessions": {"$sum": {"$cond": ["$apps.is_session_active", 1, 0]}},
+        }})
+
+        stats = {}
+        for g in _users_collection().aggregate(pipeline):
+            key = g["_id"]
+            app = stats.setdefault(str(key.get("app")), {"total": 0, "active_sessions": 0, "by_status": {}, "by_role": {}})
+            app["total"] += g["total"]
+            app["active_sessions"] += g["active_sessions"]
+            status = str(key.get("status"))
+            role = str(key.get("role"))
+            app["by_status"][status] = app["by_status"].get(status, 0) + g["total"]
+            app["by_role"][role] = app["by_role"].get(role, 0) + g["total"]
+        return stats
+
+
+# =========================================
+# GET /user/export?app_id=&format=ndjson|csv&gzip=1&batch_size=
+# =========================================
+class UserExportController(Resource):
+    route = '/user/export'
+
+    def get(self):
+        try:
+            app_id = request.args.get('app_id')
+            if not app_id:
+                return ServerResponse(message="Query parameter 'app_id' is required", status=StatusCode.BAD_REQUEST).to_response()
+            app_oid = _to_oid(app_id, app_names)
+            if not app_oid:
+                return ServerResponse(message="Application not found", status=StatusCode.NOT_FOUND).to_response()
+
+            fmt = (request.args.get('format') or "ndjson").lower()
+            if fmt not in ("ndjson", "csv"):
+                return ServerResponse(message="'format' must be 'ndjson' or 'csv'", status=StatusCode.BAD_REQUEST).to_response()
+
+            try:
+                batch_size = int(request.args.get('batch_size') or EXPORT_DEFAULT_BATCH_SIZE)
+            except ValueError:
+                batch_size = 0
+            if batch_size < 1 or batch_size > EXPORT_MAX_BATCH_SIZE:
+                return ServerResponse(
+                    message=f"'batch_size' must be an integer between 1 and {EXPORT_MAX_BATCH_SIZE}",
+                    status=StatusCode.BAD_REQUEST
+                ).to_response()
+
+            compress = request.args.get('gzip') in ("1", "true")
+
+            # una fila por membresía, aplanada en el servidor
+            pipeline = [
+                {"$match": {"apps.app": app_oid}},
+                {"$project": {"name": 1, "email": 1, "apps.app": 1, "apps.role": 1, "apps.status": 1, "apps.is_session_active": 1}},
+                {"$unwind": "$apps"},
+                {"$match": {"apps.app": app_oid}},
+            ]
+            cursor = _users_collection().aggregate(pipeline, batchSize=batch_size, allowDiskUse=True)
+            # primer documento antes de responder: un error de la agregación sigue siendo un 500
+            docs = iter(cursor)
+            first = next(docs, None)
+
+            filename = f"users-{app_oid}.{'csv' if fmt == 'csv' else 'ndjson'}"
+            mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+            if compress:
+                filename += ".gz"
+                mimetype = "application/gzip"
+
+            return Response(
+                stream_with_context(self._stream(first, docs, fmt, batch_size, compress)),
+                status=200,
+                mimetype=mimetype,
+                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            )
+
+        except Exception as e:
+            logging.error(f"[GET /user/export] {str(e)}", exc_info=True)
+            return ServerResponse(
+                message="An unexpected error occurred.",
+                message_code=UNEXPECTED_ERROR,
+                status=StatusCode.INTERNAL_SERVER_ERROR
+            ).to_response()
+
+    @staticmethod
+    def _stream(first, docs, fmt, batch_size, compress):
+        """
+        Escribe las filas de a un lote: como máximo batch_size filas en memoria.
+        """
+        gz = zlib.compressobj(wbits=31) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        if writer:
+            writer.writerow(EXPORT_COLUMNS)
+
+        def flush():
+            chunk = buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            return gz.compress(chunk) if gz else chunk
+
+        rows = 0
+        try:
+            doc = first
+            while doc is not None:
+                app = doc.get("apps") or {}
+                row = (
+                    str(doc["_id"]), doc.get("name"), doc.get("email"), str(app.get("app")),
+                    str(app.get("role")), app.get("status"), bool(app.get("is_session_active")),
+                )
+                if writer:
+                    writer.writerow(row)
+                else:
+                    buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n")
+                rows += 1
+                if rows % batch_size == 0:
+                    yield flush()
+                doc = next(docs, None)
+        except Exception as e:
+            # la respuesta ya comenzó: se corta la transferencia (sin cerrar el gzip) para que
+            # un export truncado no parezca completo
+            logging.error(f"[GET /user/export] stream aborted after {rows} rows: {str(e)}", exc_info=True)
+            raise
+
+        tail = flush()
+        if gz:
+            tail += gz.flush()
+        yield tail
+
+
+# =========================================
+# PATCH /user/batch
+# =========================================
+class UserBatchController(Resource):
+    route = '/user/batch'
+
+    def patch(self):
+        """
+        Mismos cambios que PATCH /user/<id> sobre muchos usuarios de una app, en un solo updateMany:
+        - {"app_id":"<id|name>", "user_ids":["<id>", ...], "status"|"role"|"is_session_active": ...}
+        - {"app_id":"<id|name>", "filter":{"status"?, "role"?, "is_session_active"?}, ...cambios}
+          ("filter": {} = todos los usuarios de la app)
+        Se actualizan los elementos de apps[] de esa app que cumplen el filtro. Un cambio de "role"
+        toca solo el primero de ellos y omite a los usuarios que ya tienen ese par (role, app),
+        igual que el guard de enrollment.
+        Devuelve {"matched", "modified"} (usuarios), no los documentos.
+        """
+        try:
+            data = request.get_json(force=True, silent=True) or {}
+
+            app_in = data.get("app_id")
+            if not app_in:
+                return ServerResponse(message="Field 'app_id' is required.", status=StatusCode.BAD_REQUEST).to_response()
+
+            if ("user_ids" in data) == ("filter" in data):
+                return ServerResponse(
+                    message="Provide exactly one of 'user_ids' or 'filter'.",
+                    status=StatusCode.BAD_REQUEST
+                ).to_response()
+
+            app_oid = _to_oid(app_in, app_names)
+            if not app_oid:
+                return ServerResponse(message="Application not found", status=StatusCode.NOT_FOUND).to_response()
+
+            # condición sobre el elemento de apps[] (query y array filter)
+            element = {"app": app_oid}
+            query = {}
+            if "user_ids" in data:
+                user_ids = data["user_ids"]
+                if not isinstance(user_ids, list) or not user_ids or len(user_ids) > BATCH_MAX_USER_IDS:
+                    return ServerResponse(
+                        message=f"'user_ids' must be a list of 1 to {BATCH_MAX_USER_IDS} user ids",
+                        status=StatusCode.BAD_REQUEST
+                    ).to_response()
+                if not all(ObjectId.is_valid(str(u)) for u in user_ids):
+                    return ServerResponse(message="'user_ids' contains an invalid user id", status=StatusCode.BAD_REQUEST).to_response()
+                query["_id"] = {"$in": [ObjectId(str(u)) for u in user_ids]}
+            else:
+                selector = data["filter"]
+                if not isinstance(selector, dict) or set(selector) - {"status", "role", "is_session_active"}:
+                    return ServerResponse(
+                        message="'filter' accepts only 'status', 'role' and 'is_session_active'",
+                        status=StatusCode.BAD_REQUEST
+                    ).to_response()
+                if "status" in selector:
+                    element["status"] = selector["status"]
+                if "is_session_active" in selector:
+                    element["is_session_active"] = bool(selector["is_session_active"])
+                if "role" in selector:
+                    role_oid = _to_oid(selector["role"], role_names, app_oid)
+                    if not role_oid:
+                        return ServerResponse(message="Invalid role", status=StatusCode.UNPROCESSABLE_ENTITY).to_response()
+                    element["role"] = role_oid
+
+            changes = {}
+            if "status" in data:
+                changes["status"] = data["status"]
+            if "role" in data and data["role"]:
+                role_oid = _to_oid(data["role"], role_names, app_oid)
+                if not role_oid:
+                    return ServerResponse(message="Invalid role", status=StatusCode.UNPROCESSABLE_ENTITY).to_response()
+                changes["role"] = role_oid
+            if "is_session_active" in data:
+                changes["is_session_active"] = bool(data["is_session_active"])
+
+            if not changes:
+                return ServerResponse(message="No changes provided", status=StatusCode.BAD_REQUEST).to_response()
+
+            collection = _users_collection()
+            if "role" in changes:
+                result = self._change_role(collection, app_oid, query, element, changes)
+            else:
+                query["apps"] = {"$elemMatch": element}
+                result = collection.update_many(
+                    query,
+                    {"$set": {f"apps.$[elem].{field}": value for field, value in changes.items()}},
+                    array_filters=[{f"elem.{field}": value for field, value in element.items()}]
+                )
+                if result.modified_count:
+                    # mismo $set en user_app_memberships, sin releer los usuarios de la app
+                    selector = {k: v for k, v in element.items() if k != "app"}
+                    memberships.update_for_app(collection, app_oid, selector, changes,
+                                               query["_id"]["$in"] if "_id" in query else None)
+                    _after_user_write({"_id": query["_id"]} if "_id" in query else {"apps.app": app_oid},
+                                      resync=False)
+
+            return json_response(
+                message="Users updated",
+                data={"matched": result.matched_count, "modified": result.modified_count},
+                status=StatusCode.OK
+            )
+
+        except Exception as e:
+            logging.error(f"[PATCH /user/batch] {str(e)}", exc_info=True)
+            return ServerResponse(
+                message="An unexpected error occurred.",
+                message_code=UNEXPECTED_ERROR,
+                status=StatusCode.INTERNAL_SERVER_ERROR
+            ).to_response()
+
+    @staticmethod
+    def _change_role(collection, app_oid, query, element, changes):
+        result = change_role_for_app(collection, app_oid, query, element, changes)
+        if result.modified_count:
+            # con $nin (los que ya tenían el par) no se conocen los tocados: se invalida por app
+            touched = query.get("_id", {})
+            _after_user_write({"_id": touched} if "$in" in touched else {"apps.app": app_oid})
+        return result
+
 
 # =========================================
 # GET|PATCH|DELETE /user/<id>
@@ -276,16 +946,14 @@ class UserItemController(Resource):
 
     def get(self, id: str):
         try:
-            doc = __dbmanager__.get_by_id(id)
+            doc = user_cache.get_by_id(id, __dbmanager__.get_by_id)
             if not doc or isinstance(doc, Exception):
                 return ServerResponse(
                     message="User not found",
                     message_code=USER_NOT_FOUND,
                     status=StatusCode.NOT_FOUND
                 ).to_response()
-            d = dict(doc)
-            d["id"] = str(d.pop("_id"))
-            return ServerResponse(data=d, status=StatusCode.OK).to_response()
+            return json_response(data=public_document(doc), status=StatusCode.OK)
         except Exception as e:
             logging.error(f"[GET /user/{id}] {str(e)}", exc_info=True)
             return ServerResponse(
@@ -300,6 +968,7 @@ class UserItemController(Resource):
         - {"app_id":"<id|name>", "is_session_active": true|false}
         - {"app_id":"<id|name>", "status":"Active|Pending|inactive"}
         - {"app_id":"<id|name>", "role":"<roleId|roleName>"}
+        Con ?return=app la respuesta incluye solo el elemento de apps[] modificado.
         """
         try:
             data = request.get_json(force=True, silent=True) or {}
@@ -311,33 +980,23 @@ class UserItemController(Resource):
                     status=StatusCode.BAD_REQUEST
                 ).to_response()
 
-            try:
-                app_oid = ObjectId(app_in)
-            except Exception:
-                adoc = get_app_by_name(app_in)
-                if not adoc or not adoc.get("_id"):
-                    return ServerResponse(
-                        message="Application not found",
-                        status=StatusCode.NOT_FOUND
-                    ).to_response()
-                app_oid = ObjectId(str(adoc["_id"]))
+            app_oid = _to_oid(app_in, app_names)
+            if not app_oid:
+                return ServerResponse(
+                    message="Application not found",
+                    status=StatusCode.NOT_FOUND
+                ).to_response()
 
             updates = {}
             if "status" in data:
                 updates["apps.$.status"] = data["status"]
             if "role" in data and data["role"]:
-                val = data["role"]
-                try:
-                    role_oid = ObjectId(val)
-                except Exception:
-                    rdoc = RoleModel.get_by_name(val)
-                    # FIXED: Changed from rdoc.get("_id") to hasattr(rdoc, '_id')
-                    if not rdoc or not hasattr(rdoc, '_id') or not rdoc._id:
-                        return ServerResponse(
-                            message="Invalid role",
-                            status=StatusCode.UNPROCESSABLE_ENTITY
-                        ).to_response()
-                    role_oid = ObjectId(str(rdoc._id))
+                role_oid = _to_oid(data["role"], role_names, app_oid)
+                if not role_oid:
+                    return ServerResponse(
+                        message="Invalid role",
+                        status=StatusCode.UNPROCESSABLE_ENTITY
+                    ).to_response()
                 updates["apps.$.role"] = role_oid
             if "is_session_active" in data:
                 updates["apps.$.is_session_active"] = bool(data["is_session_active"])
@@ -345,16 +1004,20 @@ class UserItemController(Resource):
             if not updates:
                 return ServerResponse(message="No changes provided", status=StatusCode.BAD_REQUEST).to_response()
 
-            result = __dbmanager__.update_by_condition(
+            # actualización y lectura del resultado en un solo round trip
+            projection = {"apps.$": 1} if request.args.get("return") == "app" else ITEM_PROJECTION
+            doc = _users_collection().find_one_and_update(
                 {"_id": ObjectId(id), "apps.app": app_oid},
-                updates
+                {"$set": updates},
+                projection=projection,
+                return_document=ReturnDocument.AFTER
             )
-            if result is None or getattr(result, "matched_count", 0) == 0:
+            if not doc:
                 return ServerResponse(message="User or app assignment not found", status=StatusCode.NOT_FOUND).to_response()
+            _after_user_write({"_id": doc["_id"]})
 
-            doc = __dbmanager__.get_by_id(id)
-            d = dict(doc); d["id"] = str(d.pop("_id"))
-            return ServerResponse(message="User app updated", data=d, status=StatusCode.OK).to_response()
+            return json_response(message="User app updated", data=public_document(_without_app_secrets(doc)),
+                                 status=StatusCode.OK)
 
         except Exception as e:
             logging.error(f"[PATCH /user/{id}] {str(e)}", exc_info=True)
@@ -371,25 +1034,20 @@ class UserItemController(Resource):
         - apps.$[].is_session_active = False
         """
         try:
-            result = __dbmanager__.update_by_condition(
-                {"_id": ObjectId(id)},
-                {"apps.$[].status": "inactive", "apps.$[].is_session_active": False}
+            updated = _users_collection().find_one_and_update(
+                {"_id": ObjectId(id), "apps": {"$type": "array"}},
+                {"$set": {"apps.$[].status": "inactive", "apps.$[].is_session_active": False}},
+                projection=ITEM_PROJECTION,
+                return_document=ReturnDocument.AFTER
             )
-            if result is None or getattr(result, "matched_count", 0) == 0:
-                # Fallback manual
-                doc = __dbmanager__.get_by_id(id)
-                if not doc or isinstance(doc, Exception):
+            if not updated:
+                # sin apps[] no hay nada que inactivar; solo queda distinguir el 404
+                updated = _users_collection().find_one({"_id": ObjectId(id)}, ITEM_PROJECTION)
+                if not updated:
                     return ServerResponse(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND).to_response()
-                d = dict(doc)
-                apps = d.get("apps", []) or []
-                for a in apps:
-                    a["status"] = "inactive"
-                    a["is_session_active"] = False
-                __dbmanager__.update_by_condition({"_id": ObjectId(id)}, {"apps": apps})
+            _after_user_write({"_id": updated["_id"]})
 
-            updated = __dbmanager__.get_by_id(id)
-            d = dict(updated); d["id"] = str(d.pop("_id"))
-            return ServerResponse(message="All accesses inactivated", data=d, status=StatusCode.OK).to_response()
+            return json_response(message="All accesses inactivated", data=public_document(updated), status=StatusCode.OK)
 
         except Exception as e:
             logging.error(f"[DELETE /user/{id}] {str(e)}", exc_info=True)
@@ -406,6 +1064,7 @@ class UserItemController(Resource):
 class UserPasswordController(Resource):
     route = '/user/password'
 
+    @rate_limited("password_change", email_field="user_email")
     def put(self):
         try:
             data = request.json or {}
@@ -429,7 +1088,7 @@ class UserPasswordController(Resource):
             if not any((a.get('status') == 'Active') for a in (user.get('apps') or [])):
                 return ServerResponse(message="User is not active", message_code=USER_NOT_ACTIVE, status=StatusCode.FORBIDDEN).to_response()
 
-            if not UserModel.verify_password(old_password, user['password']):
+            if not password_hasher.verify(old_password, user['password']):
                 return ServerResponse(message="Old password is incorrect", message_code=INVALID_OLD_PASSWORD, status=StatusCode.UNAUTHORIZED).to_response()
 
             msg = validate_password(new_password)
@@ -439,15 +1098,21 @@ class UserPasswordController(Resource):
             if new_password != confirm_password:
                 return ServerResponse(message="New password and confirm password do not match", message_code=PASSWORDS_DO_NOT_MATCH, status=StatusCode.BAD_REQUEST).to_response()
 
-            encrypted_password = EncryptionUtil().encrypt(new_password)
+            encrypted_password = password_hasher.encrypt(new_password)
             UserModel.update_password(user_email, encrypted_password)
+            user_cache.invalidate({"email": user_email})
 
             return ServerResponse(message="Password updated successfully", message_code=PASSWORD_UPDATED_SUCCESSFULLY, status=StatusCode.OK).to_response()
 
+        except HashingSaturated:
+            return ServerResponse(message="Password service is busy, try again later.", status=HTTPStatus.SERVICE_UNAVAILABLE).to_response()
+
         except Exception as e:
             logging.error(f"[PUT /user/password] {str(e)}", exc_info=True)
             return ServerResponse(message="An unexpected error occurred.", message_code=UNEXPECTED_ERROR_OCCURRED, status=StatusCode.INTERNAL_SERVER_ERROR).to_response()
 
+    @idempotent("password_reset")
+    @rate_limited("password_reset", email_field="email")
     def post(self):
         try:
             data = request.json or {}
@@ -455,7 +1120,8 @@ class UserPasswordController(Resource):
             if not user_email:
                 return ServerResponse(message="User email is required", message_code=MISSING_REQUIRED_FIELDS, status=StatusCode.BAD_REQUEST).to_response()
 
-            user = UserModel.find_by_email(user_email)
+            # solo se comprueba que exista: sirve el documento cacheado
+            user = user_cache.get_by_email(user_email, UserModel.find_by_email)
             if not user:
                 return ServerResponse(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND).to_response()
 
@@ -464,18 +1130,19 @@ class UserPasswordController(Resource):
             email_prefix = user_email.split('@')[0]
             temporal_password = f"{email_prefix}{verification_code}"
 
-            encrypted_temp_password = EncryptionUtil().encrypt(temporal_password)
+            encrypted_temp_password = password_hasher.encrypt(temporal_password)
             updated = UserModel.update_reset_password_info(user_email, verification_code, expiration_time, encrypted_temp_password)
+            user_cache.invalidate({"email": user_email})
 
             if updated:
-                try:
-                    send_email_new_password(user_email, temporal_password)
-                except Exception as e:
-                    logging.warning(f"Failed to send temp password to {user_email}: {e}")
+                outbox.enqueue_new_password(user_email, temporal_password)
                 return ServerResponse(message="Password reset initiated", message_code=PASSWORD_RESET_INITIATED, status=StatusCode.OK).to_response()
 
             return ServerResponse(message="Failed to update user information", message_code=UPDATE_USER_FAILED, status=StatusCode.INTERNAL_SERVER_ERROR).to_response()
 
+        except HashingSaturated:
+            return ServerResponse(message="Password service is busy, try again later.", status=HTTPStatus.SERVICE_UNAVAILABLE).to_response()
+
         except Exception as e:
             logging.error(f"[POST /user/password] {str(e)}", exc_info=True)
             return ServerResponse(message="An unexpected error occurred.", message_code=UNEXPECTED_ERROR_OCCURRED, status=StatusCode.INTERNAL_SERVER_ERROR).to_response()
@@ -494,39 +1161,44 @@ class UserVerificationController(Resource):
         response.headers.add("Access-Control-Allow-Methods", "GET,PUT,POST,DELETE,OPTIONS")
         return response
 
+    @rate_limited("verification", email_field="user_email")
     def put(self):
         try:
             data = request.json or {}
             email = data.get('user_email')
             code = str(data.get('verification_code') or "")
 
-            user = UserModel.find_by_email(email)
-            if not user:
-                return ServerResponse(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND).to_response()
-
-            apps = user.get('apps') or []
-            # localizar la app por código
-            target = next((a for a in apps if str(a.get('code')) == code), None)
-            if not target:
+            if not code:
                 return ServerResponse(message="Invalid verification code", message_code=INVALID_VERIFICATION_CODE, status=StatusCode.UNAUTHORIZED).to_response()
 
-            # validar expiración (YYYY/MM/DD HH:mm:SS)
-            exp_str = target.get('code_expliration')
-            try:
-                exp_dt = datetime.strptime(exp_str, "%Y/%m/%d %H:%M:%S") if exp_str else None
-            except Exception:
-                exp_dt = None
-            if exp_dt and exp_dt < datetime.utcnow():
-                return ServerResponse(message="Verification code expired", message_code=VERIFICATION_EXPIRED, status=StatusCode.UNAUTHORIZED).to_response()
-
-            # activar SOLO esa app y limpiar el código
-            target['status'] = 'Active'
-            target['code'] = ''
-            target['code_expliration'] = ''
+            # el código puede estar guardado como texto o número
+            codes = [code, int(code)] if code.isdigit() else [code]
+            now = datetime.utcnow()
+            not_expired = [
+                {"code_expliration": {"$gt": now}},
+                # documentos aún no migrados (texto YYYY/MM/DD HH:mm:SS, ver utils.code_expiry)
+                {"code_expliration": {"$gt": now.strftime("%Y/%m/%d %H:%M:%S")}},
+                # sin expiración (ausente, vacía, o ilegible y migrada a None): como antes, no vence
+                {"code_expliration": {"$in": [None, ""]}},
+            ]
+
+            # activar SOLO esa app y limpiar el código, en una sola operación atómica
+            updated = _users_collection().find_one_and_update(
+                {"email": email, "apps": {"$elemMatch": {"code": {"$in": codes}, "$or": not_expired}}},
+                {"$set": {"apps.$.status": "Active", "apps.$.code": "", "apps.$.code_expliration": None}},
+                projection={"_id": 1}
+            )
 
-            # guardar cambios (sin tocar status en root)
-            UserModel.update_user(email, {"apps": apps})
+            if not updated:
+                # distinguir el motivo solo en el camino de error
+                user = _users_collection().find_one({"email": email}, {"apps": {"$elemMatch": {"code": {"$in": codes}}}})
+                if not user:
+                    return ServerResponse(message="User not found", message_code=USER_NOT_FOUND, status=StatusCode.NOT_FOUND).to_response()
+                if not user.get("apps"):
+                    return ServerResponse(message="Invalid verification code", message_code=INVALID_VERIFICATION_CODE, status=StatusCode.UNAUTHORIZED).to_response()
+                return ServerResponse(message="Verification code expired", message_code=VERIFICATION_EXPIRED, status=StatusCode.UNAUTHORIZED).to_response()
 
+            _after_user_write({"_id": updated["_id"]})
             return ServerResponse(message="User successfully verified", message_code=VERIFICATION_SUCCESSFUL, status=StatusCode.OK).to_response()
 
         except Exception as e:
@@ -0,0 +1,215 @@
+# models/user/indexes.py
+"""
+Registro de índices de la colección de usuarios y diagnóstico de planes de consulta.
+
+    python -m models.user.indexes --ensure --check
+    python -m models.user.indexes --check --mongomock
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from models.user import memberships
+
+# (keys, opciones) de los índices que requieren los controladores de usuario
+USER_INDEXES = [
+    # find_by_email, enrollment, password, verification, bulk ($in)
+    ([("email", 1)], {"name": "email_unique", "unique": True}),
+    # GET /user?app_id= ($elemMatch sobre apps.app, paginado por _id)
+    ([("apps.app", 1), ("_id", 1)], {"name": "apps_app_id"}),
+    # PUT /user/verification: $elemMatch sobre apps.code
+    ([("apps.code", 1)], {"name": "apps_code"}),
+    # barrido de códigos vencidos (utils.code_expiry)
+    ([("apps.code_expliration", 1)], {"name": "apps_code_expiration"}),
+]
+
+
+def _query_shapes():
+    # formas de consulta de cada handler: (nombre, filtro, sort, índice que debe usar)
+    oid = ObjectId()
+    now = datetime.utcnow()
+    return [
+        ("find_by_email", {"email": "probe@example.com"}, None, "email_unique"),
+        ("bulk_enrollment_prefetch", {"email": {"$in": ["a@example.com", "b@example.com"]}}, None, "email_unique"),
+        ("list_by_app", {"apps": {"$elemMatch": {"app": oid}}, "_id": {"$gt": oid}}, [("_id", 1)], "apps_app_id"),
+        ("item_patch", {"_id": oid, "apps.app": oid}, None, "_id_"),
+        ("verification", {"email": "probe@example.com",
+                          "apps": {"$elemMatch": {"code": {"$in": ["123456"]}, "code_expliration": {"$gt": now}}}},
+         None, "email_unique"),
+        ("verification_by_code", {"apps.code": "123456"}, None, "apps_code"),
+        ("expired_code_sweep", {"apps": {"$elemMatch": {"status": "Pending", "code_expliration": {"$lt": now}}}},
+         None, "apps_code_expiration"),
+    ]
+
+
+# espera antes de reintentar los índices que fallaron
+INDEX_RETRY_SECONDS = 300
+
+_ready = False
+_retry_at = 0.0
+_created = set()    # nombres de índices confirmados
+_failures = {}      # nombre -> error del último intento
+_lock = threading.Lock()
+
+
+def _create(collection, keys, options, name):
+    try:
+        collection.create_index(keys, **options)
+        _created.add(name)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def ensure_indexes(collection):
+    """
+    Crea cada índice por separado (create_index es idempotente si la definición no cambió),
+    para que un fallo (p. ej. email_unique con emails duplicados) no impida crear los demás.
+    Devuelve {nombre: error} de los que fallaron.
+    """
+    failures = {}
+    for keys, options in USER_INDEXES:
+        error = _create(collection, keys, options, options["name"])
+        if error:
+            failures[options["name"]] = error
+    if memberships.enabled():
+        try:
+            target = memberships.memberships_collection(collection)
+        except Exception as e:
+            return {**failures, memberships.COLLECTION_NAME: str(e)}
+        for keys, options in memberships.MEMBERSHIP_INDEXES:
+            name = f"{memberships.COLLECTION_NAME}.{options['name']}"
+            error = _create(target, keys, options, name)
+            if error:
+                failures[name] = error
+    return failures
+
+
+def ensure_indexes_once(collection):
+    # se reintenta cada INDEX_RETRY_SECONDS mientras falte algún índice
+    global _ready, _retry_at
+    if _ready or time.monotonic() < _retry_at:
+        return
+    with _lock:
+        if _ready or time.monotonic() < _retry_at:
+            return
+        failures = ensure_indexes(collection)
+        _failures.clear()
+        _failures.update(failures)
+        for name, error in failures.items():
+            logging.error(f"Could not create users index {name}: {error}")
+        if failures:
+            _retry_at = time.monotonic() + INDEX_RETRY_SECONDS
+        else:
+            _ready = True
+
+
+def index_ready(name):
+    return name in _created
+
+
+def index_failures():
+    return dict(_failures)
+
+
+def _plan_nodes(plan):
+    nodes = [plan]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            nodes.extend(_plan_nodes(plan[key]))
+    for child in plan.get("inputStages", []) or []:
+        nodes.extend(_plan_nodes(child))
+    return nodes
+
+
+def _plan_indexes(nodes):
+    # índices usados por el plan; IDHACK (igualdad por _id) no informa indexName
+    names = {n["indexName"] for n in nodes if n.get("indexName")}
+    if any(n.get("stage") in ("IDHACK", "EXPRESS_IXSCAN") and not n.get("indexName") for n in nodes):
+        names.add("_id_")
+    return names
+
+
+def _leading_fields(query):
+    fields = set()
+    for key, value in query.items():
+        if isinstance(value, dict) and "$elemMatch" in value:
+            fields.update(f"{key}.{sub}" for sub in value["$elemMatch"])
+        else:
+            fields.add(key)
+    return fields
+
+
+def _registry_covers(collection, query, expected):
+    # alternativa estática cuando el backend no soporta explain() (p. ej. mongomock):
+    # el índice esperado existe en la colección y su primer campo está en el filtro
+    if expected == "_id_":
+        return "_id" in _leading_fields(query)
+    keys = next((k for k, options in USER_INDEXES if options["name"] == expected), None)
+    try:
+        existing = collection.index_information()
+    except Exception:
+        existing = {}
+    return keys is not None and expected in existing and keys[0][0] in _leading_fields(query)
+
+
+def check_query_plans(collection):
+    """
+    Ejecuta explain() sobre cada forma de consulta y devuelve un reporte; ok=False si el plan
+    ganador no usa el índice esperado (no basta con "no COLLSCAN": list_by_app siempre puede
+    recorrer _id_ por el sort).
+    """
+    report = []
+    for name, query, sort, expected in _query_shapes():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            nodes = _plan_nodes(cursor.explain()["queryPlanner"]["winningPlan"])
+            stages = [n.get("stage") for n in nodes]
+            indexes = sorted(_plan_indexes(nodes))
+            ok = expected in indexes
+        except (NotImplementedError, AttributeError, KeyError):
+            stages = indexes = None
+            ok = _registry_covers(collection, query, expected)
+        report.append({"query": name, "expected_index": expected, "indexes": indexes, "stages": stages, "ok": ok})
+    return {"ok": all(r["ok"] for r in report), "queries": report}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Users collection index management")
+    parser.add_argument("--ensure", action="store_true", help="create the registered indexes")
+    parser.add_argument("--check", action="store_true", help="fail if a handler query does not use its expected index")
+    parser.add_argument("--mongomock", action="store_true", help="run against an in-memory mongomock collection")
+    args = parser.parse_args(argv)
+
+    if args.mongomock:
+        import mongomock
+        collection = mongomock.MongoClient().db.users
+    else:
+        from models.user.db_queries import __dbmanager__
+        collection = __dbmanager__.collection
+
+    if args.ensure or args.mongomock:
+        failures = ensure_indexes(collection)
+        for name, error in failures.items():
+            sys.stderr.write(f"index {name} failed: {error}\n")
+        if failures and not args.check:
+            return 1
+
+    if args.check:
+        report = check_query_plans(collection)
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0 if report["ok"] else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+# models/user/memberships.py
+"""
+Modo de almacenamiento opcional (USER_MEMBERSHIP_INDEX=1): colección user_app_memberships
+con un documento por (app, user) que replica role/status/is_session_active del primer
+elemento de apps[] de esa app (el mismo que actualiza PATCH /user/<id>).
+
+Permite resolver "usuarios de la app X", "sesiones activas de X" y conteos por app con
+consultas cubiertas por índice, sin depender del tamaño de apps[] de cada usuario.
+
+    python -m models.user.memberships backfill [--batch-size 1000]
+"""
+import argparse
+import os
+import sys
+
+from pymongo import DeleteMany, UpdateOne
+
+COLLECTION_NAME = "user_app_memberships"
+MEMBERSHIP_FIELDS = {"apps.app": 1, "apps.role": 1, "apps.status": 1, "apps.is_session_active": 1}
+
+MEMBERSHIP_INDEXES = [
+    ([("app", 1), ("user", 1)], {"name": "app_user_unique", "unique": True}),
+    ([("app", 1), ("status", 1), ("is_session_active", 1), ("user", 1)], {"name": "app_status_session_user"}),
+    ([("user", 1)], {"name": "user"}),
+]
+
+
+def enabled():
+    return os.getenv("USER_MEMBERSHIP_INDEX") == "1"
+
+
+def memberships_collection(users_collection):
+    return users_collection.database[COLLECTION_NAME]
+
+
+def ensure_indexes(collection):
+    for keys, options in MEMBERSHIP_INDEXES:
+        collection.create_index(keys, **options)
+
+
+def _sync_ops(user_doc):
+    seen = {}
+    for app in user_doc.get("apps") or []:
+        if app.get("app") is not None and app["app"] not in seen:
+            seen[app["app"]] = app
+    ops = [
+        UpdateOne(
+            {"app": app_oid, "user": user_doc["_id"]},
+            {"$set": {
+                "role": app.get("role"),
+                "status": app.get("status"),
+                "is_session_active": bool(app.get("is_session_active")),
+            }},
+            upsert=True
+        )
+        for app_oid, app in seen.items()
+    ]
+    ops.append(DeleteMany({"user": user_doc["_id"], "app": {"$nin": list(seen)}}))
+    return ops
+
+
+def sync_users(users_collection, query):
+    """
+    Recalcula las membresías de los usuarios que cumplen `query` a partir de su apps[].
+    Se llama después de cada escritura de los controladores (solo si el modo está activo).
+    """
+    if not enabled():
+        return 0
+    ops = []
+    for user_doc in users_collection.find(query, MEMBERSHIP_FIELDS):
+        ops.extend(_sync_ops(user_doc))
+    if ops:
+        memberships_collection(users_collection).bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+async def sync_users_async(users_collection, query):
+    # sync_users con una colección Motor (modo ASGI), misma conexión que el resto del request
+    if not enabled():
+        return 0
+    ops = []
+    async for user_doc in users_collection.find(query, MEMBERSHIP_FIELDS):
+        ops.extend(_sync_ops(user_doc))
+    if ops:
+        await memberships_collection(users_collection).bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def _user_ids_cursor(users_collection, app_oid, after, limit, status, is_session_active):
+    # consulta cubierta por app_status_session_user / app_user_unique
+    query = {"app": app_oid}
+    if status is not None:
+        query["status"] = status
+    if is_session_active is not None:
+        query["is_session_active"] = is_session_active
+    if after is not None:
+        query["user"] = {"$gt": after}
+    cursor = memberships_collection(users_collection).find(query, {"_id": 0, "user": 1}).sort("user", 1)
+    return cursor.limit(limit) if limit else cursor
+
+
+def user_ids_for_app(users_collection, app_oid, after=None, limit=None, status=None, is_session_active=None):
+    cursor = _user_ids_cursor(users_collection, app_oid, after, limit, status, is_session_active)
+    return (d["user"] for d in cursor)
+
+
+async def user_ids_for_app_async(users_collection, app_oid, after=None, limit=None, status=None, is_session_active=None):
+    cursor = _user_ids_cursor(users_collection, app_oid, after, limit, status, is_session_active)
+    return [d["user"] async for d in cursor]
+
+
+def update_for_app(users_collection, app_oid, selector, changes, user_ids=None):
+    """
+    Aplica en user_app_memberships el mismo $set que PATCH /user/batch hizo sobre apps[],
+    sin releer los usuarios: `selector` son los campos del elemento (status/role/is_session_active).
+    """
+    if not enabled():
+        return 0
+    query = {"app": app_oid, **selector}
+    if user_ids is not None:
+        query["user"] = {"$in": list(user_ids)}
+    return memberships_collection(users_collection).update_many(query, {"$set": changes}).modified_count
+
+
+def counts_by_app(users_collection, app_oid):
+    # mismo formato que GET /user/stats para una app: {"total", "active_sessions", "by_status", "by_role"}
+    pipeline = [
+        {"$match": {"app": app_oid}},
+        {"$group": {
+            "_id": {"status": "$status", "role": "$role"},
+            "total": {"$sum": 1},
+            "active_sessions": {"$sum": {"$cond": ["$is_session_active", 1, 0]}},
+        }},
+    ]
+    counts = {"total": 0, "active_sessions": 0, "by_status": {}, "by_role": {}}
+    for d in memberships_collection(users_collection).aggregate(pipeline):
+        status, role = str(d["_id"].get("status")), str(d["_id"].get("role"))
+        counts["total"] += d["total"]
+        counts["active_sessions"] += d["active_sessions"]
+        counts["by_status"][status] = counts["by_status"].get(status, 0) + d["total"]
+        counts["by_role"][role] = counts["by_role"].get(role, 0) + d["total"]
+    return counts
+
+
+def backfill(users_collection, batch_size=1000):
+    memberships = memberships_collection(users_collection)
+    ensure_indexes(memberships)
+    ops, users = [], 0
+    for user_doc in users_collection.find({}, MEMBERSHIP_FIELDS).batch_size(batch_size):
+        ops.extend(_sync_ops(user_doc))
+        users += 1
+        if len(ops) >= batch_size:
+            memberships.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        memberships.bulk_write(ops, ordered=False)
+    return users
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="user_app_memberships maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    fill = sub.add_parser("backfill", help="rebuild memberships from users.apps[]")
+    fill.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    from models.user.db_queries import __dbmanager__
+    print(f"Backfilled memberships for {backfill(__dbmanager__.collection, args.batch_size)} user(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# models/user/writes.py
+"""
+Escrituras sobre apps[] de la colección de usuarios, compartidas por el controlador WSGI,
+el enrollment masivo y el modo ASGI (variantes *_async con Motor).
+"""
+from pymongo.errors import DuplicateKeyError
+
+from models.user import memberships
+from models.user.indexes import index_ready
+
+PAIR_FIELDS = {"apps.role": 1, "apps.app": 1}
+
+
+def enrollment_guard(email, apps_to_assign):
+    # el usuario no tiene ningún elemento con alguno de los pares (role, app) pedidos
+    pairs = [{"role": a["role"], "app": a["app"]} for a in apps_to_assign]
+    return {"email": email, "apps": {"$not": {"$elemMatch": {"$or": pairs}}}}
+
+
+def duplicate_assignment(doc, apps_to_assign):
+    # primer par (role, app) pedido que el usuario ya tiene, o None
+    assigned = {(str(a.get("role")), str(a.get("app"))) for a in (doc or {}).get("apps") or []}
+    return next((a for a in apps_to_assign if (str(a["role"]), str(a["app"])) in assigned), None)
+
+
+class EnrollmentRaceError(Exception):
+    # el guard no coincide y no hay par duplicado (usuario borrado o modificado en medio)
+    pass
+
+
+def _new_user(name, email, hashed, apps_to_assign):
+    return {"name": name, "password": hashed, "email": email, "apps": apps_to_assign}
+
+
+def enroll_user(collection, name, email, password, apps_to_assign, encrypt):
+    """
+    Agrega apps_to_assign al usuario `email` o lo crea. Devuelve (creado, par duplicado | None);
+    con un par duplicado no se escribe nada. encrypt(password) solo se llama si hay que insertar,
+    así un enrollment repetido cuesta dos consultas y no un hash.
+    """
+    guard = enrollment_guard(email, apps_to_assign)
+    push = {"$push": {"apps": {"$each": apps_to_assign}}}
+
+    # usuario existente sin esos pares: un solo update condicional
+    if collection.update_one(guard, push).matched_count:
+        return False, None
+
+    existing = collection.find_one({"email": email}, PAIR_FIELDS)
+    if existing is not None:
+        return _push_or_conflict(collection, guard, push, existing, apps_to_assign)
+
+    document = _new_user(name, email, encrypt(password), apps_to_assign)
+    if not index_ready("email_unique"):
+        # sin índice único (emails duplicados heredados, sin permiso de createIndex): el camino
+        # anterior, leer y luego insertar; dos altas simultáneas del mismo email pueden duplicarlo
+        collection.insert_one(document)
+        return True, None
+    try:
+        collection.insert_one(document)
+    except DuplicateKeyError:
+        # otra petición creó el email entre la lectura y el insert
+        return _push_or_conflict(collection, guard, push, collection.find_one({"email": email}, PAIR_FIELDS),
+                                 apps_to_assign)
+    return True, None
+
+
+def _push_or_conflict(collection, guard, push, existing, apps_to_assign):
+    dup = duplicate_assignment(existing, apps_to_assign)
+    if dup is not None:
+        return False, dup
+    # sin par duplicado el guard debería coincidir: se reintenta el push una vez
+    if collection.update_one(guard, push).matched_count:
+        return False, None
+    raise EnrollmentRaceError(f"Enrollment for {guard['email']} could not be applied")
+
+
+async def enroll_user_async(collection, name, email, password, apps_to_assign, encrypt):
+    # enroll_user con una colección Motor; encrypt es una corrutina (password_hasher.encrypt_async)
+    guard = enrollment_guard(email, apps_to_assign)
+    push = {"$push": {"apps": {"$each": apps_to_assign}}}
+
+    if (await collection.update_one(guard, push)).matched_count:
+        return False, None
+
+    existing = await collection.find_one({"email": email}, PAIR_FIELDS)
+    if existing is not None:
+        return await _push_or_conflict_async(collection, guard, push, existing, apps_to_assign)
+
+    document = _new_user(name, email, await encrypt(password), apps_to_assign)
+    if not index_ready("email_unique"):
+        await collection.insert_one(document)
+        return True, None
+    try:
+        await collection.insert_one(document)
+    except DuplicateKeyError:
+        existing = await collection.find_one({"email": email}, PAIR_FIELDS)
+        return await _push_or_conflict_async(collection, guard, push, existing, apps_to_assign)
+    return True, None
+
+
+async def _push_or_conflict_async(collection, guard, push, existing, apps_to_assign):
+    dup = duplicate_assignment(existing, apps_to_assign)
+    if dup is not None:
+        return False, dup
+    if (await collection.update_one(guard, push)).matched_count:
+        return False, None
+    raise EnrollmentRaceError(f"Enrollment for {guard['email']} could not be applied")
+
+
+def change_role_for_app(collection, app_oid, query, element, changes):
+    """
+    PATCH /user/batch con cambio de rol. Con apps.$[elem] un usuario con la app bajo dos roles
+    terminaría con dos pares iguales: se actualiza solo el primer elemento que cumple ($) y se
+    excluye por _id a quien ya tiene el par (app, rol nuevo), así el filtro tiene un único predicado
+    sobre apps y el positional es inequívoco. Completa `query` con el filtro aplicado.
+    """
+    role_oid = changes["role"]
+    element.setdefault("role", {"$ne": role_oid})
+    holders = {"apps": {"$elemMatch": {"app": app_oid, "role": role_oid}}}
+    if "_id" in query:
+        holders["_id"] = query["_id"]
+    excluded = {d["_id"] for d in collection.find(holders, {"_id": 1})}
+    if "_id" in query:
+        query["_id"] = {"$in": [i for i in query["_id"]["$in"] if i not in excluded]}
+    elif excluded:
+        query["_id"] = {"$nin": list(excluded)}
+    query["apps"] = {"$elemMatch": element}
+    if memberships.enabled():
+        # las membresías replican el primer elemento de la app: se resincronizan solo los tocados
+        query["_id"] = {"$in": [d["_id"] for d in collection.find(query, {"_id": 1})]}
+    return collection.update_many(
+        query,
+        {"$set": {f"apps.$.{field}": value for field, value in changes.items()}}
+    )